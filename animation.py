@@ -0,0 +1,157 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba_array
+from matplotlib.figure import Figure
+from PIL import Image
+
+from spreading import STATE_NAMES
+
+# Defines colormap for nodes in the animation
+COLORMAP = {"spreading": "red", "not_interested": "blue", "ignorant": "yellow"}
+
+
+class FrameCanvas:
+    """
+    Figure of a graph with a fixed layout that renders frames by only moving nodes between one collection per state.
+    The edges are drawn once and kept as background, every frame restores the background and draws the nodes of every
+    state on top of it. As all nodes of a collection look the same, matplotlib draws them as one cached marker
+    """
+
+    def __init__(self, coords, edges, colors, size=800, node_size=None):
+        """
+        Constructor that draws the background
+        :param coords: Array of shape (N, 2) with the position of every node
+        :param edges: Array of shape (m, 2) with the edges of the graph
+        :param colors: Array of shape (3, 4) with the RGBA colour of every state code
+        :param size: Int indicating the width and height of the frames in pixels
+        :param node_size: Float indicating the marker area of the nodes, scaled down with the number of nodes if None
+        """
+        self.coords = coords
+        self.figure = Figure(figsize=(size / 100, size / 100), dpi=100)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_axes((0, 0, 1, 1))
+        self.ax.set_axis_off()
+        large = len(coords) >= 1000
+        self.ax.add_collection(LineCollection(coords[edges], colors="black", linewidths=.2 if large else 1, zorder=1))
+        if node_size is None:
+            node_size = float(np.clip(4e4 / max(len(coords), 1), 2, 150))
+        self.nodes = [self.ax.scatter(coords[:0, 0], coords[:0, 1], s=node_size, color=color, edgecolors="black",
+                                      linewidths=0 if large else .5, zorder=2, animated=True) for color in colors]
+        margin = .05 * max(np.ptp(coords, axis=0).max(), 1) if len(coords) else 1
+        self.ax.set_xlim(coords[:, 0].min() - margin, coords[:, 0].max() + margin)
+        self.ax.set_ylim(coords[:, 1].min() - margin, coords[:, 1].max() + margin)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def render(self, states):
+        """
+        Renders one frame
+        :param states: Array with the state code of every node
+        :return: PIL.Image in palette mode with the frame
+        """
+        self.canvas.restore_region(self.background)
+        for state, nodes in enumerate(self.nodes):
+            nodes.set_offsets(self.coords[states == state])
+            self.ax.draw_artist(nodes)
+        frame = Image.fromarray(np.asarray(self.canvas.buffer_rgba())[..., :3])
+        return frame.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+
+
+# Canvas of a rendering worker process, created by _init_worker
+_canvas = None
+
+
+def _init_worker(*args):
+    """
+    Helper function that creates the canvas of a rendering worker process
+    :param args: Arguments of FrameCanvas
+    :return:
+    """
+    global _canvas
+    _canvas = FrameCanvas(*args)
+
+
+def _render(states):
+    """
+    Helper function that renders a frame in a worker process
+    :param states: Array with the state code of every node
+    :return: PIL.Image with the frame
+    """
+    return _canvas.render(states)
+
+
+class GifRenderer:
+    """
+    Observer for run_simulation that renders every iteration into a GIF. The graph is laid out once and the frames
+    are rendered in memory, without writing any images to disk. With one worker every frame is rendered when it is
+    observed, with several workers the states of the iterations are collected and rendered in a process pool when
+    the renderer is closed, streaming the frames into the GIF as they finish
+    """
+
+    def __init__(self, topology, path="information_spread.gif", colormap=None, duration=1000, size=800, workers=1):
+        """
+        Constructor that lays out the graph
+        :param topology: CityVillageTopology object of the run
+        :param path: String containing the path of the GIF
+        :param colormap: Dictionary indicating colour for each state, defaults to COLORMAP
+        :param duration: Int indicating the time every frame is shown in milliseconds
+        :param size: Int indicating the width and height of the frames in pixels
+        :param workers: Int indicating the number of processes rendering frames, None uses all cores
+        """
+        colormap = COLORMAP if colormap is None else colormap
+        graph = topology.to_igraph()
+        # igraph picks DrL for large graphs, which takes minutes for 10^4 nodes. The grid variant of
+        # Fruchterman-Reingold only computes the repulsion between nearby nodes, which takes seconds
+        if graph.vcount() < 1000:
+            layout = graph.layout("auto")
+        else:
+            layout = graph.layout_fruchterman_reingold(grid=True)
+        coords = np.asarray(layout.coords, dtype=np.float64).reshape(-1, 2)
+        # igraph draws the y axis downwards
+        coords[:, 1] *= -1
+        colors = to_rgba_array([colormap[state] for state in STATE_NAMES])
+        self.canvas_args = (coords, topology.edges(), colors, size)
+        self.path = path
+        self.duration = duration
+        self.workers = os.cpu_count() if workers is None else workers
+        self.canvas = FrameCanvas(*self.canvas_args) if self.workers == 1 else None
+        self.frames = []
+        self.pending = []
+
+    def __call__(self, states, number):
+        """
+        Renders one frame, or keeps the states to render it later when using several workers
+        :param states: Array with the state code of every node
+        :param number: Int indicating the iteration
+        :return:
+        """
+        if self.canvas is not None:
+            self.frames.append(self.canvas.render(states))
+        else:
+            self.pending.append(np.array(states, dtype=np.int8))
+
+    def close(self):
+        """
+        Renders the remaining frames and writes the GIF
+        :return:
+        """
+        if self.pending:
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(self.pending)), initializer=_init_worker,
+                                     initargs=self.canvas_args) as executor:
+                self._write(executor.map(_render, self.pending))
+        elif self.frames:
+            self._write(iter(self.frames))
+        self.frames, self.pending = [], []
+
+    def _write(self, frames):
+        """
+        Helper function to write frames to the GIF
+        :param frames: Iterator of PIL.Image frames
+        :return:
+        """
+        first = next(frames)
+        first.save(self.path, save_all=True, append_images=frames, duration=self.duration, loop=0)
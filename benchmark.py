@@ -0,0 +1,288 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+from cityvillage import Dwelling, CityVillageGraph
+from simulation import SimSettings, build_topology, get_start_points, run_simulation
+from spreading import SpreadingEngine, IGNORANT, SPREADING, NOT_INTERESTED
+
+# Default grid of graph sizes and connection probabilities, every combination is benchmarked
+GRID = {
+    "city_size": [100, 1000, 5000],
+    "village_size": [10, 50],
+    "nr_villages": [5, 50],
+    "connect_prob_city": [0.01, 0.1],
+    "connect_prob_vil": [0.1, 0.5],
+}
+QUICK_GRID = {
+    "city_size": [100, 1000],
+    "village_size": [10],
+    "nr_villages": [5, 50],
+    "connect_prob_city": [0.1],
+    "connect_prob_vil": [0.5],
+}
+# Settings whose stop times are compared against the reference loop, on top of the SimSettings
+SEMANTICS_CASES = [
+    {"decay": True, "time_out": False, "spreading_prob": 0.6},
+    {"decay": True, "time_out": False, "spreading_prob": 0.8},
+    {"decay": False, "time_out": True, "spreading_prob": 0.8},
+    {"decay": False, "time_out": True, "spreading_prob": 0.3, "spreading_time": 5},
+    {"decay": True, "time_out": False, "spreading_prob": 0.8, "spreading_time": 0},
+    {"decay": True, "time_out": False, "spreading_prob": 0.6, "num_start_points": 5, "only_villages": False},
+]
+
+
+def measure(function, repeat):
+    """
+    Times a function and records the peak memory allocated while it runs. The memory is traced in a separate
+    call, as tracing slows down the timed calls
+    :param function: Callable without arguments, called once per repetition
+    :param repeat: Int indicating the number of repetitions
+    :return: Tuple (times, peak_memory), list of run times in seconds and peak memory in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return times, peak_memory
+
+
+def benchmark_config(config, repeat, seed):
+    """
+    Runs all benchmarks for one point of the grid
+    :param config: SimSettings object with the graph sizes and connection probabilities of the grid point
+    :param repeat: Int indicating the number of repetitions of every benchmark
+    :param seed: Int used to seed the random generators
+    :return: Dictionary mapping the benchmark name to a tuple (times, peak_memory)
+    """
+    rng = np.random.default_rng(seed)
+    results = {"dwelling": measure(lambda: Dwelling(number_nodes=config.city_size, prob=config.connect_prob_city,
+                                                    rng=rng), repeat)}
+
+    city = Dwelling(number_nodes=config.city_size, prob=config.connect_prob_city, rng=rng)
+    villages = [Dwelling(number_nodes=config.village_size, prob=config.connect_prob_vil, rng=rng)
+                for _ in range(config.nr_villages)]
+    results["add_dwellings"] = measure(lambda: CityVillageGraph(time_out=config.time_out,
+                                                                spreading_time=config.spreading_time)
+                                       .add_dwellings(city, villages, rng=rng), repeat)
+
+    results["topology"] = measure(lambda: build_topology(config, rng), repeat)
+
+    # Time per iteration, averaged over complete runs on the same graph
+    topology = build_topology(config, rng)
+
+    def spread():
+        engine = SpreadingEngine(topology.indptr, topology.indices, spreading_time=config.spreading_time,
+                                 time_out=config.time_out, rng=rng)
+        engine.start_spreading(get_start_points(config, rng))
+        iterations = []
+        while not engine.not_spreading() and len(iterations) < config.max_iterations:
+            start = time.perf_counter()
+            engine.step(spread_prob=config.spreading_prob)
+            iterations.append(time.perf_counter() - start)
+        return iterations
+
+    iterations = [t for _ in range(repeat) for t in spread()]
+    results["spread_iteration"] = (iterations, measure(spread, 0)[1])
+
+    results["run_simulation"] = measure(lambda: run_simulation(config, rng=rng), repeat)
+    return results
+
+
+def run_benchmarks(grid, repeat=3, seed=0):
+    """
+    Runs the benchmarks for every combination of the grid
+    :param grid: Dictionary mapping SimSettings attribute names to lists of values
+    :param repeat: Int indicating the number of repetitions of every benchmark
+    :param seed: Int used to seed the random generators
+    :return: Dictionary with the environment and a list of results
+    """
+    results = []
+    names = list(grid)
+    for values in itertools.product(*grid.values()):
+        config = SimSettings()
+        params = dict(zip(names, values))
+        for name, value in params.items():
+            setattr(config, name, value)
+        print(f"Benchmarking {params}")
+        for name, (times, peak_memory) in benchmark_config(config, repeat, seed).items():
+            results.append({"name": name, "params": params, "times": times,
+                            "median": float(np.median(times)) if times else 0.0,
+                            "min": float(np.min(times)) if times else 0.0,
+                            "peak_memory": peak_memory})
+    meta = {"date": datetime.now().isoformat(), "python": sys.version, "numpy": np.__version__,
+            "platform": platform.platform(), "repeat": repeat, "seed": seed}
+    return {"meta": meta, "results": results}
+
+
+def compare(base, new, threshold=0.1):
+    """
+    Compares two benchmark results and flags the benchmarks whose median time increased by more than threshold
+    :param base: Dictionary with the results of the baseline, as returned by run_benchmarks
+    :param new: Dictionary with the results to compare against the baseline
+    :param threshold: Float indicating the tolerated relative slowdown
+    :return: List of (name, params, ratio) tuples of the regressions
+    """
+    def key(result):
+        return result["name"], json.dumps(result["params"], sort_keys=True)
+
+    base_results = {key(result): result for result in base["results"]}
+    regressions = []
+    for result in new["results"]:
+        reference = base_results.get(key(result))
+        if reference is None or reference["median"] == 0:
+            continue
+        ratio = result["median"] / reference["median"]
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{result['name']:<18} {key(result)[1]:<110} {reference['median']:10.5f}s {result['median']:10.5f}s "
+              f"{ratio:6.2f}x {flag}")
+        if flag:
+            regressions.append((result["name"], result["params"], ratio))
+    return regressions
+
+
+def reference_step(indptr, indices, states, time, time_out, spread_prob, rng):
+    """
+    Runs one iteration of spreading with the loop over the nodes in index order of the original
+    CityVillageGraph.spread_information, used as reference for the semantics of the SpreadingEngine. A node informed
+    by a node with a lower index acts in the same iteration, and its action flag keeps it from stopping in it
+    :param indptr: CSR index pointer array of the graph
+    :param indices: CSR neighbour array of the graph
+    :param states: Array with the state code of every node, updated in place
+    :param time: Array with the remaining spreading time of every node, updated in place
+    :param time_out: Boolean indicating whether nodes stop spreading after some iterations or not
+    :param spread_prob: Float indicating the spreading probability for this iteration
+    :param rng: np.random.Generator used for spreading
+    :return:
+    """
+    action = np.zeros(states.size, dtype=bool)
+    for node in range(states.size):
+        if states[node] != SPREADING:
+            continue
+        neighbours = indices[indptr[node]:indptr[node + 1]]
+        if time_out:
+            time[node] -= 1
+        if ((states[neighbours] != IGNORANT).all() or time[node] <= 0) and not action[node]:
+            states[node] = NOT_INTERESTED
+            action[node] = True
+        for neighbour in neighbours:
+            if states[neighbour] == IGNORANT and rng.random() < spread_prob and not action[neighbour]:
+                states[neighbour] = SPREADING
+                action[neighbour] = True
+
+
+def reference_run(config, topology, start_points, rng):
+    """
+    Performs one run of the simulation with reference_step, like the original run_simulation
+    :param config: SimSettings object that determines all parameters of the simulation
+    :param topology: CityVillageTopology to run on
+    :param start_points: Array of the start nodes
+    :param rng: np.random.Generator used for spreading
+    :return: Int indicating the number of iterations of the run
+    """
+    states = np.full(topology.number_nodes, IGNORANT, dtype=np.int8)
+    states[start_points] = SPREADING
+    time = np.full(topology.number_nodes, config.spreading_time, dtype=np.int64)
+    count = 0
+    spreading_prob = config.spreading_prob
+    while (states == SPREADING).any() and count < config.max_iterations:
+        count = count + 1
+        reference_step(topology.indptr, topology.indices, states, time, config.time_out, spreading_prob, rng)
+        if config.decay:
+            spreading_prob = spreading_prob * np.exp(config.decay_param * count)
+    return count
+
+
+def ks_statistic(first, second):
+    """
+    Two sample Kolmogorov-Smirnov statistic, the largest distance between the empirical distribution functions
+    :param first: Array of samples
+    :param second: Array of samples
+    :return: Float
+    """
+    values = np.union1d(first, second)
+    first_cdf = np.searchsorted(np.sort(first), values, side="right") / len(first)
+    second_cdf = np.searchsorted(np.sort(second), values, side="right") / len(second)
+    return float(np.abs(first_cdf - second_cdf).max())
+
+
+def check_semantics(cases, runs=200, seed=0, alpha_factor=1.95):
+    """
+    Compares the distribution of the stop times of run_simulation with reference_run on the same networks and start
+    points, for every case. A case fails if the Kolmogorov-Smirnov statistic exceeds the critical value of the
+    asymptotic test at a significance of 0.1%
+    :param cases: List of dictionaries with the settings that replace the SimSettings
+    :param runs: Int indicating the number of runs per case
+    :param seed: Int used to seed the random generators
+    :param alpha_factor: Float coefficient of the critical value, 1.95 for a significance of 0.1%
+    :return: List of the cases that failed
+    """
+    failed = []
+    critical = alpha_factor * np.sqrt(2 / runs)
+    for case in cases:
+        config = SimSettings()
+        for name, value in case.items():
+            setattr(config, name, value)
+        engine_times, reference_times = [], []
+        for run in range(runs):
+            topology = build_topology(config, np.random.default_rng([seed, run]))
+            engine_times.append(run_simulation(config, rng=np.random.default_rng([seed, run, 1]), topology=topology))
+            start_points = get_start_points(config, np.random.default_rng([seed, run, 1]))
+            reference_times.append(reference_run(config, topology, start_points, np.random.default_rng([seed, run, 2])))
+        statistic = ks_statistic(engine_times, reference_times)
+        flag = "MISMATCH" if statistic > critical else ""
+        print(f"{json.dumps(case):<100} mean {np.mean(engine_times):6.2f} / {np.mean(reference_times):6.2f} "
+              f"median {np.median(engine_times):5.1f} / {np.median(reference_times):5.1f} KS {statistic:.3f} {flag}")
+        if flag:
+            failed.append(case)
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks graph construction, spreading and complete runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results to a JSON file")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--quick", action="store_true", help="use a small grid")
+    for name in GRID:
+        run_parser.add_argument(f"--{name.replace('_', '-')}", type=type(GRID[name][0]), nargs="+", dest=name,
+                                help=f"values of {name}, replaces the default grid")
+    compare_parser = subparsers.add_parser("compare", help="compare two benchmark result files")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    semantics_parser = subparsers.add_parser("semantics", help="compare the stop times of the engine with the "
+                                                               "original loop over the nodes")
+    semantics_parser.add_argument("--runs", type=int, default=200)
+    semantics_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        grid = dict(QUICK_GRID if args.quick else GRID)
+        grid.update({name: getattr(args, name) for name in GRID if getattr(args, name) is not None})
+        with open(args.output, "w") as f:
+            json.dump(run_benchmarks(grid, repeat=args.repeat, seed=args.seed), f, indent=2)
+    elif args.command == "semantics":
+        if check_semantics(SEMANTICS_CASES, runs=args.runs, seed=args.seed):
+            sys.exit(1)
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        if compare(base, new, threshold=args.threshold):
+            sys.exit(1)
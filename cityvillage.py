@@ -1,26 +1,29 @@
 import numpy as np
 from igraph import Graph
 
+from instrument import NULL_INSTRUMENTATION
+from spreading import SpreadingEngine
+from topology import edges_to_csr, sample_gnp_edges, sample_bridge_edges
+
 
 class Dwelling(Graph):
     """
     Class to represent either a village or a city
     """
 
-    def __init__(self, number_nodes, prob, *args, **kwds):
+    def __init__(self, number_nodes, prob, *args, rng=None, **kwds):
         """
-        Constructor that adds a number_nodes nodes to the graph and connects them with prob probability
+        Constructor that adds a number_nodes nodes to the graph and connects them with prob probability.
+        All edges are sampled at once and added to the graph in a single call
         :param number_nodes: Int that indicates the number of nodes in the Dwelling
         :param prob: Float that indicates the probability of two nodes being connected by an edge in the Dwelling
         :param args: Args to be passed to super
+        :param rng: np.random.Generator used to sample the edges, a new unseeded one if None
         :param kwds: kwds to be passed to super
         """
         super().__init__(*args, **kwds)
-        for _ in range(number_nodes):
-            self.add_vertex()
-            new_vertex_id = self.vcount() - 1
-            edges = [(new_vertex_id, i) for i in range(self.vcount() - 1) if np.random.random() <= prob]
-            self.add_edges(edges)
+        self.add_vertices(number_nodes)
+        self.add_edges(sample_gnp_edges(number_nodes, prob, rng=rng))
 
 
 class CityVillageGraph(Graph):
@@ -66,42 +69,49 @@ class CityVillageGraph(Graph):
         self.time_out = tmp_time_out
         return self
 
-    def add_dwellings(self, city, villages):
+    def add_dwellings(self, city, villages, rng=None, debug_file=None, instrumentation=NULL_INSTRUMENTATION):
         """
-        Adds a city and a list of villages to the graph
+        Adds a city and a list of villages to the graph. The vertex offsets of all dwellings are computed once and
+        all edges, including the connections between city and villages, are added in a single operation
         :param city: Dwelling object that represents the city
         :param villages: List of Dwelling objects that represent the villages
+        :param rng: np.random.Generator used to sample the connections, a new unseeded one if None
+        :param debug_file: Optional path of a file the city, villages and combined graph are printed to
+        :param instrumentation: Instrumentation object that records the time of the phases and the added nodes and
+            edges
         :return: self
         """
-        # If city has not been added yet, add city and
-        # connections between city and village
-        filename = './output.txt'
+        rng = np.random.default_rng() if rng is None else rng
         self.city = city
         self.villages = villages
-        self += city
-        for village in villages:
-            self += village
-
-        # add number of vertexes in city to fix problem with vertex numbers in overall graph
-        idx = city.vcount()
-        # add nr_connections many edges between each village and city
-        for village in villages:
-            number_connections = int(abs(np.random.normal(self.nr_connections - 1))) + 1
-            for _ in range(number_connections):
-                village_node = np.random.choice(village.vs)
-                city_node = np.random.choice(city.vs)
-                # possible solution: add city size and size previous villages to village_node.index
-                self.add_edge(village_node.index + idx, city_node.index)
-                # add number of vertexes in village to fix problem with vertex numbers in overall graph
-                with open(filename, 'w') as f:
-                    print(city, file=f)
+        with instrumentation.phase("collect_edges"):
+            dwellings = [city] + list(villages)
+            sizes = np.array([dwelling.vcount() for dwelling in dwellings], dtype=np.int64)
+            # Index boundaries of the vertices of every dwelling in the overall graph
+            offsets = self.vcount() + np.concatenate(([0], np.cumsum(sizes)))
+            edges = [np.asarray(dwelling.get_edgelist(), dtype=np.int64).reshape(-1, 2) + offset
+                     for dwelling, offset in zip(dwellings, offsets)]
+
+        with instrumentation.phase("bridges"):
+            # add nr_connections many edges between each village and city
+            edges.append(sample_bridge_edges(offsets, self.nr_connections, rng=rng))
+
+        with instrumentation.phase("add_edges"):
+            edges = np.concatenate(edges)
+            self.add_vertices(int(sizes.sum()))
+            self.add_edges(edges)
+        instrumentation.count("nodes_added", int(sizes.sum()))
+        instrumentation.count("edges_added", len(edges))
+
+        if debug_file is not None:
+            with instrumentation.phase("debug_output"), open(debug_file, 'w') as f:
+                print(city, file=f)
+                for village in villages:
                     print(village, file=f)
-                    print(self, file=f)
-            idx = idx + village.vcount()
+                print(self, file=f)
 
         # Set initial properties of nodes
         self.vs["state"] = "ignorant"
-        self.vs["action"] = False
         self.vs["time"] = self.spreading_time
         return self
 
@@ -133,43 +143,36 @@ class CityVillageGraph(Graph):
             not_spreading = False
         return not_spreading
 
-    def spread_information(self, nr_not_interested=0, nr_spreading=0, spread_prob=0.4):
+    def to_csr(self):
         """
-        Method used to run one iteration of spreading information.
+        Helper function to convert the adjacency of the graph to CSR index arrays, as used by the SpreadingEngine
+        :return: Tuple (indptr, indices) of NumPy arrays
+        """
+        return edges_to_csr(self.vcount(), self.get_edgelist())
+
+    def spread_information(self, nr_not_interested=0, nr_spreading=0, spread_prob=0.4, rng=None,
+                           instrumentation=NULL_INSTRUMENTATION):
+        """
+        Method used to run one iteration of spreading information on the node attributes of the graph.
+        The iteration itself is run by a SpreadingEngine, use the engine directly to run several iterations
+        without converting the attributes every time
         :param nr_not_interested: Int indicating the number of not_interested nodes at the beginning of the iteration
         :param nr_spreading: Int indicating the number of spreading nodes at the beginning of the iteration
         :param spread_prob: Float indicating the spreading probability for this iteration
+        :param rng: np.random.Generator used for spreading, a new unseeded one if None
+        :param instrumentation: Instrumentation object that records the time of the phases, the traversed edges and
+            the nodes that changed state
         :return: List of integers indicating the number of not_interested, spreading and ignorant nodes after iteration
         """
-        self.vs["action"] = False
-
-        for node_idx in self.vs.indices:
-
-            # Node has nothing to share
-            if self.vs[node_idx]["state"] == "ignorant":
-                continue
-
-            if self.vs[node_idx]["state"] == "not_interested":
-                continue
-
-            neigh_idxs = self.neighborhood(self.vs[node_idx], order=1, mindist=1)
-            # only reduce when using iterations to change from spreading to not interested
-            if self.time_out:
-                self.vs[node_idx]["time"] -= 1
-            if (all(self.vs[neigh]["state"] == "spreading" or
-                    self.vs[neigh]["state"] == "not_interested" for neigh in neigh_idxs) or self.vs[node_idx][
-                    "time"] <= 0) and \
-                    not self.vs[node_idx]["action"]:
-                self.vs[node_idx]["state"] = "not_interested"
-                self.vs[node_idx]["action"] = True
-                nr_not_interested += 1
-                nr_spreading -= 1
-
-            for neighbour in neigh_idxs:
-                if self.vs[neighbour]["state"] == "ignorant":
-                    if np.random.random() < spread_prob and not self.vs[neighbour]["action"]:
-                        nr_spreading += 1
-                        self.vs[neighbour]["action"] = True
-                        self.vs[neighbour]["state"] = "spreading"
-
+        with instrumentation.phase("convert"):
+            engine = SpreadingEngine.from_graph(self, rng=rng)
+        with instrumentation.phase("spreading"):
+            new_not_interested, new_spreading = engine.step(spread_prob)
+        with instrumentation.phase("write_back"):
+            engine.write_back(self)
+        instrumentation.count("iterations")
+        instrumentation.count("edges_traversed", engine.edges_traversed)
+        instrumentation.count("nodes_changed", new_not_interested + new_spreading)
+        nr_not_interested += new_not_interested
+        nr_spreading += new_spreading - new_not_interested
         return [nr_not_interested, nr_spreading, self.vcount() - nr_spreading - nr_not_interested]
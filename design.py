@@ -0,0 +1,263 @@
+import itertools
+import json
+from dataclasses import dataclass, field
+
+import numpy as np
+
+DESIGNS = ("oat", "factorial", "lhs", "sobol")
+
+# Primitive polynomials (degree s, coefficients a) and initial direction numbers m of the Sobol sequence in dimension
+# 2 and up, from the new-joe-kuo-6.21201 table of Joe and Kuo. Dimension 1 is the van der Corput sequence
+SOBOL_DIRECTIONS = [
+    (1, 0, [1]), (2, 1, [1, 3]), (3, 1, [1, 3, 1]), (3, 2, [1, 1, 1]), (4, 1, [1, 1, 3, 3]), (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]), (5, 4, [1, 1, 5, 5, 5]), (5, 7, [1, 1, 7, 11, 19]), (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]), (5, 14, [1, 3, 5, 5, 31]), (6, 1, [1, 3, 3, 9, 7, 49]), (6, 13, [1, 1, 1, 15, 21, 21]),
+    (6, 16, [1, 3, 1, 13, 27, 49]), (6, 19, [1, 1, 1, 15, 7, 5]), (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]), (7, 1, [1, 3, 7, 11, 23, 15, 103]), (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+]
+SOBOL_BITS = 32
+
+
+def sobol_directions(dimensions):
+    """
+    Computes the direction numbers of the Sobol sequence
+    :param dimensions: Int indicating the number of dimensions, at most len(SOBOL_DIRECTIONS) + 1
+    :return: Array of shape (dimensions, SOBOL_BITS) with the direction numbers scaled to SOBOL_BITS bits
+    """
+    if dimensions > len(SOBOL_DIRECTIONS) + 1:
+        raise ValueError(f"The Sobol design supports at most {len(SOBOL_DIRECTIONS) + 1} parameters")
+    directions = np.zeros((dimensions, SOBOL_BITS), dtype=np.uint64)
+    directions[0] = 1 << np.arange(SOBOL_BITS - 1, -1, -1, dtype=np.uint64)
+    for dimension, (degree, coefficients, initial) in enumerate(SOBOL_DIRECTIONS[:dimensions - 1], start=1):
+        m = list(initial)
+        for k in range(degree, SOBOL_BITS):
+            value = m[k - degree] ^ (m[k - degree] << degree)
+            for j in range(1, degree):
+                if (coefficients >> (degree - 1 - j)) & 1:
+                    value ^= m[k - j] << j
+            m.append(value)
+        directions[dimension] = [m[k] << (SOBOL_BITS - 1 - k) for k in range(SOBOL_BITS)]
+    return directions
+
+
+def sobol_points(directions, start, stop, shift=None):
+    """
+    Computes points start to stop of the Sobol sequence directly from their index, so the sequence can be generated
+    in independent chunks
+    :param directions: Array of direction numbers as returned by sobol_directions
+    :param start: Int indicating the index of the first point
+    :param stop: Int indicating the index after the last point
+    :param shift: Optional array of shape (dimensions,) of random integers for a digital shift (scrambling)
+    :return: Array of shape (stop - start, dimensions) with points in [0, 1)
+    """
+    index = np.arange(start, stop, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+    points = np.zeros((index.size, directions.shape[0]), dtype=np.uint64)
+    for bit in range(SOBOL_BITS):
+        points ^= ((gray >> np.uint64(bit)) & np.uint64(1))[:, None] * directions[:, bit]
+    if shift is not None:
+        points ^= shift
+    return points / float(2 ** SOBOL_BITS)
+
+
+@dataclass
+class SweepTask:
+    """
+    Data class for one independent simulation run of a parameter sweep
+    """
+    index: int  # Position of the task in the sweep, used to order the results
+    parameter_name: str  # Name of the parameter varied in the experiment
+    spreading_method_name: str  # Name of the spreading method of the experiment
+    situation_name: str  # Name of the start point situation
+    run: int  # Number of the run
+    settings: dict  # SimSettings attributes that are changed for this task
+    seed: np.random.SeedSequence  # Seed of the random generator of the task
+
+
+@dataclass
+class Parameter:
+    """
+    Data class for a parameter of a sweep, either with discrete values or a continuous range
+    """
+    name: str  # Name of the SimSettings attribute
+    values: list = None  # Discrete values of the parameter, used by all designs
+    low: float = None  # Lower bound of a continuous range, used by the lhs and sobol designs instead of values
+    high: float = None  # Upper bound of a continuous range
+    integer: bool = False  # If True, the range holds the integers low to high
+
+    def levels(self):
+        """
+        Helper function to get the discrete values of the parameter
+        :return: List of values
+        """
+        if self.values is None:
+            raise ValueError(f"Parameter {self.name} needs values for one-at-a-time and full factorial designs")
+        return self.values
+
+    def scale(self, units):
+        """
+        Maps points of the unit interval to values of the parameter
+        :param units: Array of floats in [0, 1)
+        :return: List of values
+        """
+        if self.integer:
+            # Every integer of [low, high] gets an equal share of the unit interval
+            return np.floor(self.low + units * (self.high - self.low + 1)).astype(int).tolist()
+        if self.values is None:
+            return (self.low + units * (self.high - self.low)).tolist()
+        return [self.values[i] for i in (units * len(self.values)).astype(int)]
+
+
+@dataclass
+class SweepSpec:
+    """
+    Declarative description of a parameter sweep: the varied parameters, the design that combines their values,
+    the spreading methods, the start point situations and the number of replicates. The tasks are generated lazily,
+    so designs with millions of points never have to be held in memory
+    """
+    parameters: list  # Parameter objects
+    methods: dict  # Mapping of spreading method name to the SimSettings attributes of the method
+    situations: dict  # Mapping of situation name to the SimSettings attributes of the start points
+    design: str = "oat"  # One of DESIGNS: one-at-a-time, full factorial, Latin hypercube or Sobol sequence
+    samples: int = 0  # Number of points of the lhs and sobol designs
+    replicates: int = 1  # Number of runs of every point, method and situation
+    seed: int = 0  # Seed of the random designs and of the runs
+    baseline: dict = field(default_factory=dict)  # SimSettings attributes changed for all tasks
+
+    def __post_init__(self):
+        if self.design not in DESIGNS:
+            raise ValueError(f"Unknown design {self.design}, use one of {', '.join(DESIGNS)}")
+
+    @classmethod
+    def from_experiments(cls, config, experiments):
+        """
+        Creates the one-at-a-time specification of the Experiments
+        :param config: SimSettings object that contains the baseline parameters
+        :param experiments: Experiments object that contains the parameter ranges
+        :return: SweepSpec
+        """
+        methods = {name: {"decay": decay, "time_out": time_out} for name, decay, time_out in
+                   zip(experiments.spreading_method_names, experiments.decay, experiments.time_out)}
+        situations = {name: {"num_start_points": experiments.num_start_points[situation[0]],
+                             "only_villages": experiments.only_villages[situation[1]],
+                             "only_cities": experiments.only_cities[situation[2]]}
+                      for name, situation in zip(experiments.situation_name, experiments.situations)}
+        parameters = [Parameter(name, values=list(values))
+                      for name, values in zip(experiments.parameter_names, experiments.parameters)]
+        return cls(parameters, methods, situations, design="oat", replicates=config.runs, seed=config.seed)
+
+    @classmethod
+    def from_dict(cls, spec, config, experiments):
+        """
+        Creates a specification from a dictionary, e.g. read from JSON. Parameters are given as a mapping of name to
+        either a list of values or a dictionary with low, high and optionally integer. Methods and situations default
+        to those of the Experiments, replicates and seed to runs and seed of the SimSettings
+        :param spec: Dictionary with the keys parameters, design, samples, replicates, seed, methods, situations and
+            baseline, all but parameters are optional
+        :param config: SimSettings object that contains the baseline parameters
+        :param experiments: Experiments object that provides the default methods and situations
+        :return: SweepSpec
+        """
+        defaults = cls.from_experiments(config, experiments)
+        parameters = [Parameter(name, values=value) if isinstance(value, list) else Parameter(name, **value)
+                      for name, value in spec["parameters"].items()]
+        return cls(parameters, spec.get("methods", defaults.methods), spec.get("situations", defaults.situations),
+                   design=spec.get("design", "oat"), samples=spec.get("samples", 0),
+                   replicates=spec.get("replicates", defaults.replicates), seed=spec.get("seed", defaults.seed),
+                   baseline=spec.get("baseline", {}))
+
+    @classmethod
+    def load(cls, path, config, experiments):
+        """
+        Reads a specification from a JSON file, see from_dict
+        :param path: String containing the path of the JSON file
+        :param config: SimSettings object that contains the baseline parameters
+        :param experiments: Experiments object that provides the default methods and situations
+        :return: SweepSpec
+        """
+        with open(path) as f:
+            return cls.from_dict(json.load(f), config, experiments)
+
+    def number_points(self):
+        """
+        Number of points of the design, for one-at-a-time designs summed over all parameters
+        :return: Int
+        """
+        if self.design == "oat":
+            return sum(len(parameter.levels()) for parameter in self.parameters)
+        if self.design == "factorial":
+            return int(np.prod([len(parameter.levels()) for parameter in self.parameters]))
+        return self.samples
+
+    def __len__(self):
+        """
+        Number of tasks of the sweep
+        :return: Int
+        """
+        return self.number_points() * len(self.methods) * len(self.situations) * self.replicates
+
+    def points(self, chunk_size=4096):
+        """
+        Generates the points of the design lazily. For one-at-a-time designs the points are grouped by parameter,
+        the other designs vary all parameters at once
+        :param chunk_size: Int indicating the number of points of the random designs computed at once
+        :return: Generator of dictionaries mapping parameter names to values
+        """
+        if self.design == "oat":
+            for parameter in self.parameters:
+                for value in parameter.levels():
+                    yield {parameter.name: value}
+        elif self.design == "factorial":
+            names = [parameter.name for parameter in self.parameters]
+            for values in itertools.product(*[parameter.levels() for parameter in self.parameters]):
+                yield dict(zip(names, values))
+        else:
+            rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(2 ** 32 - 1,)))
+            if self.design == "lhs":
+                # Every parameter gets one point in each of the samples strata, in a random order per parameter
+                strata = np.stack([rng.permutation(self.samples) for _ in self.parameters], axis=1)
+            else:
+                directions = sobol_directions(len(self.parameters))
+                shift = rng.integers(0, 2 ** SOBOL_BITS, size=len(self.parameters), dtype=np.uint64)
+            for start in range(0, self.samples, chunk_size):
+                stop = min(start + chunk_size, self.samples)
+                if self.design == "lhs":
+                    units = (strata[start:stop] + rng.random((stop - start, len(self.parameters)))) / self.samples
+                else:
+                    units = sobol_points(directions, start, stop, shift)
+                columns = [parameter.scale(units[:, i]) for i, parameter in enumerate(self.parameters)]
+                for values in zip(*columns):
+                    yield {parameter.name: value for parameter, value in zip(self.parameters, values)}
+
+    def parameter_name(self, point):
+        """
+        Helper function to get the name the results of a point are stored under
+        :param point: Dictionary mapping parameter names to values, as generated by points
+        :return: String, the varied parameter for one-at-a-time designs and the design name otherwise
+        """
+        return next(iter(point)) if self.design == "oat" else self.design
+
+    def tasks(self):
+        """
+        Generates the tasks of the sweep lazily. Tasks are ordered by point group (the parameter for one-at-a-time
+        designs), method, replicate, situation and point, and task i is seeded with SeedSequence(seed, spawn_key=(i,)),
+        the same seed it would get from SeedSequence(seed).spawn
+        :return: Generator of SweepTask objects
+        """
+        groups = itertools.groupby(self.points(), key=self.parameter_name) if self.design == "oat" else \
+            [(self.design, None)]
+        index = 0
+        for parameter_name, group in groups:
+            # One-at-a-time groups are small, the points of the other designs are generated again for every
+            # method, replicate and situation instead of being kept in memory
+            group = list(group) if group is not None else None
+            for method_name, method in self.methods.items():
+                for run in range(self.replicates):
+                    for situation_name, situation in self.situations.items():
+                        for point in group if group is not None else self.points():
+                            settings = {**self.baseline, **method, **situation, **point}
+                            yield SweepTask(index=index, parameter_name=parameter_name,
+                                            spreading_method_name=method_name, situation_name=situation_name,
+                                            run=run, settings=settings,
+                                            seed=np.random.SeedSequence(self.seed, spawn_key=(index,)))
+                            index += 1
@@ -0,0 +1,82 @@
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+
+from topology import CityVillageTopology
+
+# Version of the on-disk layout, stored in meta.json and checked when loading
+FORMAT_VERSION = 1
+ARRAYS = ("offsets", "indptr", "indices", "village_id")
+
+
+def save_graph(path, topology):
+    """
+    Stores a topology as a directory of .npy files (offsets, indptr, indices and village_id) and a meta.json file. The
+    files are written to a temporary directory that is renamed afterwards, so a stored graph is either complete or
+    absent, also when several processes store the same graph at once
+    :param path: String containing the directory of the graph
+    :param topology: CityVillageTopology object
+    :return:
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(tmp_path, exist_ok=True)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(getattr(topology, name)))
+    meta = {"format": FORMAT_VERSION, "number_nodes": topology.number_nodes, "nr_villages": topology.nr_villages,
+            "number_edges": int(topology.indices.size // 2)}
+    with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another process stored the same graph first
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            raise
+        shutil.rmtree(tmp_path)
+
+
+def load_graph(path, mmap=True):
+    """
+    Loads a topology stored by save_graph. With mmap the arrays are read-only memory maps of the files, so loading is
+    zero-copy and all processes that load the same graph share its memory through the page cache
+    :param path: String containing the directory of the graph
+    :param mmap: Boolean, if False the arrays are read into memory
+    :return: CityVillageTopology object
+    """
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["format"] != FORMAT_VERSION:
+        raise ValueError(f"The graph in {path} has format {meta['format']}, expected {FORMAT_VERSION}")
+    arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None) for name in ARRAYS}
+    if arrays["indptr"].size != meta["number_nodes"] + 1 or arrays["indices"].size != 2 * meta["number_edges"]:
+        raise ValueError(f"The arrays in {path} do not match its meta.json")
+    return CityVillageTopology(**arrays)
+
+
+def is_stored(path):
+    """
+    Helper function to check whether a complete graph is stored in a directory
+    :param path: String containing the directory of the graph
+    :return: Boolean
+    """
+    return os.path.exists(os.path.join(path, "meta.json"))
+
+
+if __name__ == '__main__':
+    from simulation import SimSettings, build_topology
+
+    parser = argparse.ArgumentParser(description="Creates a network with the SimSettings and stores it on disk")
+    parser.add_argument("path", help="directory the graph is written to")
+    for name in ("city_size", "village_size", "nr_villages", "connect_prob_city", "connect_prob_vil", "seed"):
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(getattr(SimSettings, name)), dest=name,
+                            help=f"replaces {name} of the SimSettings")
+    args = parser.parse_args()
+
+    config = SimSettings()
+    for name, value in vars(args).items():
+        if name != "path" and value is not None:
+            setattr(config, name, value)
+    save_graph(args.path, build_topology(config, np.random.default_rng(config.seed)))
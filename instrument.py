@@ -0,0 +1,135 @@
+import cProfile
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Prefix of the result columns with the metrics of instrumented runs, they are exported to separate CSV files
+METRIC_PREFIX = "metric_"
+
+
+class Instrumentation:
+    """
+    Collects the wall time spent in the phases of the simulation and counters of events, such as the number of
+    iterations, traversed edges and nodes that changed state
+    """
+
+    def __init__(self):
+        """
+        Constructor that creates empty timers and counters
+        """
+        self.timers = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager that adds the wall time of its body to the timer of a phase
+        :param name: String containing the name of the phase
+        :return:
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        """
+        Increases a counter
+        :param name: String containing the name of the counter
+        :param value: Int that is added to the counter
+        :return:
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def metrics(self):
+        """
+        Collects all timers and counters
+        :return: Dictionary mapping time_{phase} to the seconds spent in the phase and the counter names to their value
+        """
+        metrics = {f"time_{name}": seconds for name, seconds in self.timers.items()}
+        metrics.update(self.counters)
+        return metrics
+
+    def report(self):
+        """
+        Helper function to format the timers and counters as text
+        :return: String with one line per timer and counter
+        """
+        total = sum(self.timers.values())
+        lines = [f"{name:<20} {seconds:10.4f}s {100 * seconds / total if total else 0:6.1f}%"
+                 for name, seconds in sorted(self.timers.items(), key=lambda item: -item[1])]
+        lines += [f"{name:<20} {value:>11}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+
+class NullInstrumentation(Instrumentation):
+    """
+    Instrumentation that records nothing, used when instrumentation is switched off
+    """
+    _context = nullcontext()
+
+    def phase(self, name):
+        """
+        Context manager that does not time its body
+        :param name: String identifying the phase, ignored
+        :return: Shared null context manager
+        """
+        return self._context
+
+    def count(self, name, value=1):
+        """
+        Ignores a counted value
+        :param name: String identifying the counter, ignored
+        :param value: Number that would be added to the counter, ignored
+        :return:
+        """
+
+
+# Shared instance used whenever no instrumentation is requested
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+def get_instrumentation(config):
+    """
+    Helper function to create the instrumentation of a run
+    :param config: SimSettings object, instrumentation is enabled by its instrument attribute
+    :return: Instrumentation object, the shared NullInstrumentation if instrumentation is disabled
+    """
+    return Instrumentation() if config.instrument else NULL_INSTRUMENTATION
+
+
+@contextmanager
+def profile(mode, path):
+    """
+    Context manager that profiles its body. With "cprofile" the cProfile statistics are written to {path}.prof, to be
+    inspected with pstats or snakeviz, and with "tracemalloc" the peak memory and the 25 lines that allocated most
+    memory are written to {path}.txt
+    :param mode: String "cprofile" or "tracemalloc", or None to not profile
+    :param path: String containing the path of the output file without extension
+    :return:
+    """
+    if mode is None:
+        yield
+    elif mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f"{path}.prof")
+    elif mode == "tracemalloc":
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            with open(f"{path}.txt", "w") as f:
+                print(f"Peak memory: {peak / 2 ** 20:.1f} MiB", file=f)
+                for statistic in snapshot.statistics("lineno")[:25]:
+                    print(statistic, file=f)
+    else:
+        raise ValueError(f"Unknown profile mode {mode}, use 'cprofile' or 'tracemalloc'")
@@ -0,0 +1,158 @@
+import numpy as np
+
+
+class SpreadingModel:
+    """
+    Dynamics of the spreading, plugged into a BatchSpreadingEngine. The engine gathers the edges between the spreading
+    nodes and their neighbours and calls the kernels of the model, which work on whole arrays of all replicates:
+    transmission gives the probability of every trial along an edge to an ignorant node, stopping decides which
+    spreading nodes become not_interested and advance updates the model after every iteration.
+    In the base model every spreading node informs every ignorant neighbour with probability spread_prob and stops
+    once none of its neighbours is ignorant or its time in the time matrix of the engine is up. New models override
+    the kernels, calling super() so the models combine through multiple inheritance, e.g. DecayTimeoutModel
+    """
+
+    def __init__(self, spread_prob=0.4, node_prob=None):
+        """
+        Constructor that sets the parameters of the model
+        :param spread_prob: Float, or array of shape (R,), indicating the spreading probability of every replicate
+        :param node_prob: Optional array of shape (N,), or (R, N), with a factor per node that the spreading
+            probability is multiplied with when the node spreads
+        """
+        self.spread_prob = spread_prob
+        self.node_prob = None if node_prob is None else np.asarray(node_prob, dtype=np.float64)
+        self.prob = spread_prob
+
+    def start(self, engine):
+        """
+        Resets the model at the beginning of a run
+        :param engine: BatchSpreadingEngine the model is used by
+        :return:
+        """
+        self.prob = self.spread_prob
+
+    def transmission(self, engine, spreaders, targets, spread_prob=None):
+        """
+        Kernel that computes the probability of the trials of an iteration
+        :param engine: BatchSpreadingEngine the model is used by
+        :param spreaders: Array with the flat index of the spreading node of every trial
+        :param targets: Array with the flat index of the ignorant node of every trial
+        :param spread_prob: Optional float, or array of shape (R,), used instead of the current probability
+        :return: Float or array with the probability of every trial
+        """
+        prob = self.prob if spread_prob is None else spread_prob
+        if np.ndim(prob):
+            prob = np.asarray(prob)[targets // engine.number_nodes]
+        if self.node_prob is not None:
+            factors = self.node_prob.reshape(-1)
+            prob = prob * factors[spreaders % factors.size]
+        return prob
+
+    def stopping(self, engine, spreaders, has_ignorant):
+        """
+        Kernel that decides which spreading nodes become not_interested in an iteration. It is called with all nodes
+        that act in the iteration, the engine ignores the decision for nodes that were informed in the iteration
+        :param engine: BatchSpreadingEngine the model is used by
+        :param spreaders: Array with the flat index of every acting node
+        :param has_ignorant: Boolean array indicating for every acting node whether it has an ignorant neighbour at
+            the moment it acts
+        :return: Boolean array indicating for every spreading node whether it stops
+        """
+        return ~has_ignorant | (engine.time.reshape(-1)[spreaders] <= 0)
+
+    def advance(self, engine, iteration):
+        """
+        Kernel that updates the model after an iteration
+        :param engine: BatchSpreadingEngine the model is used by
+        :param iteration: Int indicating the number of the iteration that finished, starting at 1
+        :return:
+        """
+
+
+class DecayModel(SpreadingModel):
+    """
+    Model in which the spreading probability decays after every iteration, in iteration t it is multiplied with
+    exp(decay_param * t)
+    """
+
+    def __init__(self, spread_prob=0.4, decay_param=-0.025, **kwargs):
+        """
+        Constructor that sets the parameters of the model
+        :param spread_prob: Float, or array of shape (R,), indicating the initial spreading probability
+        :param decay_param: Float indicating the decay of the spreading probability
+        :param kwargs: Parameters of the other models that are combined with this one
+        """
+        super().__init__(spread_prob, **kwargs)
+        self.decay_param = decay_param
+
+    def advance(self, engine, iteration):
+        """
+        Kernel that decays the spreading probability after an iteration
+        :param engine: BatchSpreadingEngine the model is used by
+        :param iteration: Int indicating the number of the iteration that finished, starting at 1
+        :return:
+        """
+        super().advance(engine, iteration)
+        self.prob = self.prob * np.exp(self.decay_param * iteration)
+
+
+class TimeoutModel(SpreadingModel):
+    """
+    Model in which the time of spreading nodes counts down, so they also stop after spreading for spreading_time
+    iterations
+    """
+
+    def __init__(self, spread_prob=0.4, spreading_time=5, **kwargs):
+        """
+        Constructor that sets the parameters of the model
+        :param spread_prob: Float, or array of shape (R,), indicating the spreading probability
+        :param spreading_time: Int indicating the number of iterations a node spreads
+        :param kwargs: Parameters of the other models that are combined with this one
+        """
+        super().__init__(spread_prob, **kwargs)
+        self.spreading_time = spreading_time
+
+    def start(self, engine):
+        """
+        Resets the model and the time of all nodes to spreading_time at the beginning of a run
+        :param engine: BatchSpreadingEngine the model is used by
+        :return:
+        """
+        super().start(engine)
+        engine.time[...] = self.spreading_time
+
+    def stopping(self, engine, spreaders, has_ignorant):
+        """
+        Kernel that counts down the time of the acting nodes before deciding which of them stop, so a node also
+        stops once its time is up
+        :param engine: BatchSpreadingEngine the model is used by
+        :param spreaders: Array with the flat index of every acting node
+        :param has_ignorant: Boolean array indicating for every acting node whether it has an ignorant neighbour at
+            the moment it acts
+        :return: Boolean array indicating for every spreading node whether it stops
+        """
+        engine.time.reshape(-1)[spreaders] -= 1
+        return super().stopping(engine, spreaders, has_ignorant)
+
+
+class DecayTimeoutModel(DecayModel, TimeoutModel):
+    """
+    Model combining a decaying spreading probability with a limited spreading time
+    """
+
+
+def model_from_config(config, node_prob=None):
+    """
+    Helper function to create the spreading model of the settings of a simulation
+    :param config: SimSettings object, the model is selected by its decay and time_out attributes
+    :param node_prob: Optional array of shape (N,), or (R, N), with a spreading probability factor per node
+    :return: SpreadingModel
+    """
+    kwargs = {"node_prob": node_prob}
+    if config.decay:
+        kwargs["decay_param"] = config.decay_param
+    if config.time_out:
+        kwargs["spreading_time"] = config.spreading_time
+    model = {(False, False): SpreadingModel, (True, False): DecayModel, (False, True): TimeoutModel,
+             (True, True): DecayTimeoutModel}[(config.decay, config.time_out)]
+    return model(config.spreading_prob, **kwargs)
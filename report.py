@@ -0,0 +1,105 @@
+import os
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+
+def plot_statistics(not_interested_counts, spreading_counts, ignorant_counts):
+    """
+    Plots the number of nodes of certain states against iterations
+    :param not_interested_counts: List of nodes in the not_interested state at given iteration
+    :param spreading_counts: List of nodes in the spreading state at given iteration
+    :param ignorant_counts: List of nodes in the ignorant state at given iteration
+    :return:
+    """
+    plt.figure(figsize=(10, 6))
+    plt.plot(ignorant_counts, label='Ignorant', c='yellow')
+    plt.plot(spreading_counts, label='Spreading', c='red')
+    plt.plot(not_interested_counts, label='Not Interested', c='darkblue')
+    plt.title('Number Of Nodes For Each State Over Time')
+    plt.xlabel('Iteration')
+    plt.ylabel('Number of Nodes')
+    plt.legend()
+    plt.grid(True)
+    plt.savefig('overview_over_information_spread.png')
+
+
+def plot_boxplot(df, parameter_name, spreading_method_name):
+    """
+    Plots a boxplot of a given spreading_method
+    :param df: dataset containing the data to plot
+    :param parameter_name: name of the spreading parameter that was varied
+    :param spreading_method_name: name of the used spreading_method
+    :return:
+    """
+    df.boxplot(column="time", by="situation")
+
+    plt.title(f'Sensitivity analysis of parameter {parameter_name} with spreading method {spreading_method_name}')
+    plt.xlabel('Startpoint')
+    plt.ylabel('Time')
+    check_create_dir("sensitivity")
+    plt.savefig(f"sensitivity/{parameter_name}_{spreading_method_name}.png")
+    plt.close()
+
+
+def plot_scatterplot(df, parameter_name, spreading_method_name, situation_name, rng=None):
+    """
+    Function to plot a scatter plot of experiment results of a parameter variation
+    Jitters points if they are on top of each other. Points are drawn with one scatter call per parameter value
+    :param df: dataset containing the simulation data
+    :param parameter_name: parameter that was varied in experiment
+    :param spreading_method_name: spreading method used in the experiment
+    :param situation_name: list of situations that were covered
+    :param rng: np.random.Generator used for the jitter, a new unseeded one if None
+    :return:
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    x = pd.Categorical(df.situation, categories=situation_name, ordered=True).codes.astype(float)
+    y = df['time'].to_numpy()
+    # If point already there, add jitter
+    duplicated = pd.DataFrame({"x": x, "y": y}).duplicated().to_numpy()
+    x[duplicated] += rng.uniform(-0.1, 0.1, size=duplicated.sum())
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    colormap = plt.colormaps.get_cmap("tab10")
+    unique_param_values = np.sort(df[parameter_name].unique())
+    color_index = np.searchsorted(unique_param_values, df[parameter_name].to_numpy())
+    for i, val in enumerate(unique_param_values):
+        mask = color_index == i
+        ax.scatter(x[mask], y[mask], color=colormap(i % colormap.N), label=f'{parameter_name} = {val}')
+    plt.legend(loc="best", title=f"Color legend for {parameter_name}")
+
+    ax.set_xticks(np.arange(len(situation_name)))
+    ax.set_xticklabels(situation_name)
+    plt.title(f'Sensitivity analysis of parameter {parameter_name} with spreading method {spreading_method_name}')
+    plt.xlabel('Situation')
+    plt.ylabel('Time')
+    plt.ylim((0, 32))
+    plt.savefig(f"sensitivity/{parameter_name}_{spreading_method_name}_scatter.png")
+    plt.close()
+
+
+def plot_report(df, parameter_name, spreading_method_name, situation_name):
+    """
+    Report stage of an experiment, plots the complete results of one parameter and spreading method
+    :param df: dataset containing the simulation data
+    :param parameter_name: parameter that was varied in experiment
+    :param spreading_method_name: spreading method used in the experiment
+    :param situation_name: list of situations that were covered
+    :return:
+    """
+    plot_boxplot(df, parameter_name, spreading_method_name)
+    plot_scatterplot(df, parameter_name, spreading_method_name, situation_name)
+
+
+def check_create_dir(name):
+    """
+    Function to check whether a directory exists, and if it doesn't create it
+    :param name: name of the directory
+    :return:
+    """
+    exists = os.path.exists(name)
+    if not exists:
+        os.makedirs(name)
+        print(f"The {name} directory is created!")
@@ -0,0 +1,411 @@
+import glob
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from instrument import METRIC_PREFIX
+
+try:
+    import pyarrow  # noqa: F401 Only needed to store the results as Parquet
+except ImportError:
+    pyarrow = None
+
+# Columns stored next to the get_row_dict columns, they are dropped again when exporting to CSV
+TASK_COLUMNS = ["task_index", "parameter_name", "spreading_method_name"]
+# Quantiles of the time of every cell in the aggregates of the ResultIndex
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class ResultSink:
+    """
+    Append-only on-disk store for the results of a sweep. Every batch of finished tasks is written as its own part
+    file, in Parquet if pyarrow is installed and as CSV otherwise, so a crashed sweep keeps all finished batches
+    and can be resumed from them
+    """
+
+    def __init__(self, directory, fingerprint=None):
+        """
+        Constructor that opens or creates the store
+        :param directory: String containing the directory of the part files
+        :param fingerprint: Optional string identifying the sweep, a store of a different sweep is cleared, so the
+            sweep starts over
+        """
+        self.directory = directory
+        self.extension = "parquet" if pyarrow is not None else "csv"
+        os.makedirs(directory, exist_ok=True)
+        if fingerprint is not None:
+            manifest = self._manifest()
+            if manifest.get("fingerprint", fingerprint) != fingerprint:
+                print(f"The results in {directory} belong to a different sweep, starting over")
+                self.clear()
+                manifest = {}
+            if "fingerprint" not in manifest:
+                self._write_manifest(dict(manifest, fingerprint=fingerprint))
+        self._completed = None
+
+    def _manifest(self):
+        """
+        Helper function to read the manifest of the store
+        :return: Dictionary with the fingerprint of the sweep and the CSV files exported from the store, empty if
+            there is no manifest
+        """
+        path = os.path.join(self.directory, "sweep.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        """
+        Helper function to write the manifest of the store
+        :param manifest: Dictionary with the fingerprint of the sweep and the CSV files exported from the store
+        :return:
+        """
+        with open(os.path.join(self.directory, "sweep.json"), "w") as f:
+            json.dump(manifest, f)
+
+    def parts(self):
+        """
+        Lists the part files of the store, ordered by the index of their first task
+        :return: List of file paths
+        """
+        return sorted(glob.glob(os.path.join(self.directory, f"part-*.{self.extension}")))
+
+    def _read(self, path, columns=None):
+        """
+        Reads one part file
+        :param path: String containing the path of the part file
+        :param columns: Optional list of columns to read
+        :return: DataFrame
+        """
+        if self.extension == "parquet":
+            return pd.read_parquet(path, columns=columns)
+        return pd.read_csv(path, usecols=columns)
+
+    def completed(self):
+        """
+        Collects the indices of all tasks whose results are stored
+        :return: Set of task indices
+        """
+        if self._completed is None:
+            self._completed = set()
+            for path in self.parts():
+                self._completed.update(self._read(path, columns=["task_index"])["task_index"].tolist())
+        return self._completed
+
+    def read(self, columns=None):
+        """
+        Reads all stored results
+        :param columns: Optional list of columns to read
+        :return: DataFrame with one row per stored task
+        """
+        frames = [self._read(path, columns=columns) for path in self.parts()]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+    def append(self, tasks, rows):
+        """
+        Writes the results of a batch of tasks as a new part file. The file is written under a temporary name and
+        renamed afterwards, so a part file is either complete or absent
+        :param tasks: List of SweepTask objects
+        :param rows: List of dictionary rows as generated by get_row_dict, one per task
+        :return:
+        """
+        if not tasks:
+            return
+        df = pd.DataFrame(rows)
+        df.insert(0, "task_index", [task.index for task in tasks])
+        df.insert(1, "parameter_name", [task.parameter_name for task in tasks])
+        df.insert(2, "spreading_method_name", [task.spreading_method_name for task in tasks])
+        path = os.path.join(self.directory, f"part-{tasks[0].index:010d}.{self.extension}")
+        tmp_path = path + ".tmp"
+        if self.extension == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.completed().update(df["task_index"].tolist())
+
+    def clear(self):
+        """
+        Removes all part files and the manifest of the store, together with the CSV files exported from it, so the
+        results of the previous sweep are not mixed with those of the next one
+        :return:
+        """
+        exported = [os.path.join(self.directory, path) for path in self._manifest().get("exported", [])]
+        for path in exported + glob.glob(os.path.join(self.directory, "part-*")) + \
+                [os.path.join(self.directory, "sweep.json")]:
+            if os.path.exists(path):
+                os.remove(path)
+        self._completed = None
+
+    def export_csv(self, directory, parameters=None):
+        """
+        Exports the results to one CSV file per parameter and spreading method, named
+        {parameter_name}_{spreading_method_name}.csv, with the columns of get_row_dict. The metrics of instrumented
+        runs are exported to metrics/{parameter_name}_{spreading_method_name}.csv, with one row per run holding the
+        situation, the values of the varied parameters, the time and the metrics. They are kept in a subdirectory,
+        as the statistical analysis reads every CSV file of the directory of a seed. The part files are
+        streamed one at a time, so memory stays bounded by the size of a part
+        :param directory: String containing the directory the CSV files are written to
+        :param parameters: Optional list of the names of the varied parameters, used for the metrics of designs that
+            vary several parameters at once, whose parameter_name is the name of the design. If None, the metrics
+            hold all settings of get_row_dict
+        :return: List of (parameter_name, spreading_method_name) tuples that were exported
+        """
+        exported = []
+        written = []
+        for path in self.parts():
+            df = self._read(path).sort_values("task_index")
+            metric_columns = [column for column in df.columns if column.startswith(METRIC_PREFIX)]
+            for (parameter_name, spreading_method_name), group in df.groupby(
+                    ["parameter_name", "spreading_method_name"], sort=False):
+                filename = os.path.join(directory, f"{parameter_name}_{spreading_method_name}")
+                first = (parameter_name, spreading_method_name) not in exported
+                if first:
+                    exported.append((parameter_name, spreading_method_name))
+                    written.append(f"{filename}.csv")
+                group.drop(columns=TASK_COLUMNS + metric_columns).to_csv(f"{filename}.csv", mode="w" if first else "a",
+                                                                         header=first, index=False)
+                if metric_columns:
+                    if parameter_name in group.columns:
+                        varied = [parameter_name]
+                    elif parameters is not None:
+                        varied = [name for name in parameters if name in group.columns]
+                    else:
+                        varied = [column for column in group.columns
+                                  if column not in TASK_COLUMNS + metric_columns + ["situation", "time"]]
+                    metrics = group[["situation"] + varied + ["time"] + metric_columns]
+                    metrics.columns = [column[len(METRIC_PREFIX):] if column in metric_columns else column
+                                       for column in metrics.columns]
+                    metrics_path = os.path.join(directory, "metrics", f"{parameter_name}_{spreading_method_name}.csv")
+                    os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+                    metrics.to_csv(metrics_path, mode="w" if first else "a", header=first, index=False)
+                    if first:
+                        written.append(metrics_path)
+        # The exported files are removed again when the store is cleared
+        self._write_manifest(dict(self._manifest(),
+                                  exported=[os.path.relpath(path, self.directory) for path in written]))
+        return exported
+
+
+class ResultIndex:
+    """
+    Index of the exported result CSV files of all seeds, csv/{seed}/{parameter_name}_{spreading_method_name}.csv. Every
+    file is ingested once into a typed columnar part, Parquet if pyarrow is installed and a pickled DataFrame
+    otherwise, with categorical strings and downcast integers, together with the aggregates of the time of every
+    cell, i.e. every combination of settings. A manifest of the modification time and size of the files is kept, so
+    update only ingests files that are new or changed and drops the parts of removed files
+    """
+
+    def __init__(self, directory="csv/index", source="csv"):
+        """
+        Constructor that opens or creates the index
+        :param directory: String containing the directory of the index
+        :param source: String containing the directory with one directory of CSV files per seed
+        """
+        self.directory = directory
+        self.source = source
+        self.extension = "parquet" if pyarrow is not None else "pkl"
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def sources(self):
+        """
+        Lists the result CSV files of all seeds, leaving out the metric files, including those of older versions
+        that were written next to the results, and the stores of running sweeps
+        :return: Dictionary mapping the path of every file relative to source to a list [mtime_ns, size]
+        """
+        files = {}
+        for path in glob.glob(os.path.join(self.source, "*", "*.csv")):
+            seed = os.path.basename(os.path.dirname(path))
+            if not seed.lstrip("-").isdigit() or path.endswith("_metrics.csv"):
+                continue
+            stat = os.stat(path)
+            files[os.path.relpath(path, self.source)] = [stat.st_mtime_ns, stat.st_size]
+        return files
+
+    def _part(self, name, kind):
+        """
+        Helper function to get the path of a part of the index
+        :param name: String containing the path of the CSV file relative to source
+        :param kind: String "rows" or "summary"
+        :return: String containing the path
+        """
+        return os.path.join(self.directory, f"{kind}-{name[:-len('.csv')].replace(os.sep, '-')}.{self.extension}")
+
+    def _write(self, df, path):
+        """
+        Helper function to write a part under a temporary name and rename it afterwards
+        :param df: DataFrame
+        :param path: String containing the path of the part
+        :return:
+        """
+        tmp_path = path + ".tmp"
+        if self.extension == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+
+    def _read(self, path, columns=None):
+        """
+        Helper function to read a part
+        :param path: String containing the path of the part
+        :param columns: Optional list of columns to read
+        :return: DataFrame
+        """
+        if self.extension == "parquet":
+            return pd.read_parquet(path, columns=columns)
+        df = pd.read_pickle(path)
+        return df if columns is None else df[columns]
+
+    def update(self):
+        """
+        Ingests the result files that are new or changed since the last update and removes the parts of result
+        files that were deleted
+        :return: List of the paths of the ingested files relative to source
+        """
+        files = self.sources()
+        ingested = [name for name, stat in sorted(files.items()) if self.manifest.get(name) != stat]
+        for name in ingested:
+            seed, filename = os.path.split(name)
+            parameter_name, spreading_method_name = filename[:-len(".csv")].rsplit("_", 1)
+            df = pd.read_csv(os.path.join(self.source, name))
+            df.insert(0, "seed", int(seed))
+            df.insert(1, "parameter_name", parameter_name)
+            df.insert(2, "spreading_method_name", spreading_method_name)
+            df = compact_dtypes(df)
+            self._write(df, self._part(name, "rows"))
+            self._write(time_summary(df), self._part(name, "summary"))
+            self.manifest[name] = files[name]
+        removed = sorted(set(self.manifest) - set(files))
+        for name in removed:
+            for kind in ("rows", "summary"):
+                if os.path.exists(self._part(name, kind)):
+                    os.remove(self._part(name, kind))
+            del self.manifest[name]
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        if ingested or removed:
+            # Plain CSV copy of the aggregates for the statistical analysis in R
+            self.summary().to_csv(os.path.join(self.directory, "summary.csv"), index=False)
+        return ingested
+
+    def _select(self, seeds=None, parameter_name=None, spreading_method_name=None):
+        """
+        Helper function to select the indexed result files
+        :param seeds: Optional iterable of seeds to select
+        :param parameter_name: Optional string, only select files of this parameter
+        :param spreading_method_name: Optional string, only select files of this spreading method
+        :return: List of the paths of the files relative to source
+        """
+        selected = []
+        for name in sorted(self.manifest):
+            seed, filename = os.path.split(name)
+            parameter, method = filename[:-len(".csv")].rsplit("_", 1)
+            if (seeds is None or int(seed) in seeds) and parameter_name in (None, parameter) and \
+                    spreading_method_name in (None, method):
+                selected.append(name)
+        return selected
+
+    def _concat(self, names, kind, columns=None):
+        """
+        Helper function to read and combine parts, keeping the strings categorical
+        :param names: List of the paths of the result files relative to source
+        :param kind: String "rows" or "summary"
+        :param columns: Optional list of columns to read
+        :return: DataFrame
+        """
+        frames = [self._read(self._part(name, kind), columns=columns) for name in names]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        # concat only keeps categorical columns whose categories are equal in all parts, otherwise it falls back to
+        # plain strings, so the categories are unified first
+        for column in frames[0].columns:
+            if all(isinstance(frame[column].dtype, pd.CategoricalDtype) for frame in frames if column in frame):
+                categories = pd.api.types.union_categoricals(
+                    [frame[column] for frame in frames if column in frame]).categories
+                for frame in frames:
+                    if column in frame:
+                        frame[column] = frame[column].cat.set_categories(categories)
+        return pd.concat(frames, ignore_index=True)
+
+    def read(self, seeds=None, parameter_name=None, spreading_method_name=None, columns=None):
+        """
+        Reads the indexed rows, with the columns seed, parameter_name and spreading_method_name in front of the
+        columns of the CSV files
+        :param seeds: Optional iterable of seeds to read, all seeds if None
+        :param parameter_name: Optional string, only read the results of this parameter
+        :param spreading_method_name: Optional string, only read the results of this spreading method
+        :param columns: Optional list of columns to read
+        :return: DataFrame
+        """
+        return self._concat(self._select(seeds, parameter_name, spreading_method_name), "rows", columns)
+
+    def summary(self, seeds=None, parameter_name=None, spreading_method_name=None):
+        """
+        Reads the aggregates of the time of every cell, see time_summary
+        :param seeds: Optional iterable of seeds to read, all seeds if None
+        :param parameter_name: Optional string, only read the cells of this parameter
+        :param spreading_method_name: Optional string, only read the cells of this spreading method
+        :return: DataFrame with one row per cell
+        """
+        return self._concat(self._select(seeds, parameter_name, spreading_method_name), "summary")
+
+
+def compact_dtypes(df):
+    """
+    Converts the columns of a result DataFrame to compact types: strings become categorical and integers are downcast
+    to the smallest integer type. Floats are kept as float64, so parameter values stay exact
+    :param df: DataFrame
+    :return: DataFrame with the converted columns
+    """
+    for column in df.columns:
+        if pd.api.types.is_bool_dtype(df[column]) or pd.api.types.is_float_dtype(df[column]):
+            continue
+        if pd.api.types.is_integer_dtype(df[column]):
+            df[column] = pd.to_numeric(df[column], downcast="integer")
+        else:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def time_summary(df, quantiles=QUANTILES):
+    """
+    Aggregates the time of the runs of every cell, i.e. of every combination of the values of all other columns
+    :param df: DataFrame of results with a time column
+    :param quantiles: Floats of the quantiles of the time to compute
+    :return: DataFrame with the columns of the cell, count, mean and q{100 * quantile} for every quantile
+    """
+    keys = [column for column in df.columns if column != "time"]
+    grouped = df.groupby(keys, observed=True, dropna=False, sort=False)["time"]
+    summary = grouped.agg(["count", "mean"])
+    for quantile in quantiles:
+        summary[f"q{100 * quantile:g}"] = grouped.quantile(quantile)
+    return summary.reset_index()
+
+
+def sweep_fingerprint(config, tasks):
+    """
+    Helper function to identify a sweep by its baseline settings and tasks. The tasks are hashed one at a time, so
+    they can be generated lazily
+    :param config: SimSettings object that contains the baseline parameters
+    :param tasks: Iterable of SweepTask objects
+    :return: String containing a hash of the sweep
+    """
+    ignored = {"loadSim", "workers", "resume", "topology_cache_size", "topology_cache_dir", "profile",
+               "render_workers"}
+    settings = {name: getattr(config, name) for name in dir(config)
+                if not name.startswith("_") and name not in ignored and not callable(getattr(config, name))}
+    fingerprint = hashlib.sha1(repr(sorted(settings.items())).encode())
+    for task in tasks:
+        fingerprint.update(repr((task.parameter_name, task.spreading_method_name, task.situation_name, task.run,
+                                 sorted(task.settings.items()))).encode())
+    return fingerprint.hexdigest()
@@ -0,0 +1,451 @@
+import argparse
+import ast
+from dataclasses import dataclass
+
+import numpy as np
+
+from graphstore import load_graph
+from instrument import NULL_INSTRUMENTATION, get_instrumentation, profile
+from models import model_from_config
+from spreading import SpreadingEngine, BatchSpreadingEngine
+from topology import CityVillageTopology
+from trajectory import TrajectoryRecorder
+
+
+def __getattr__(name):
+    """
+    Provides Dwelling and CityVillageGraph of cityvillage.py, which are only imported when used, as importing igraph
+    takes most of the start up time of a worker
+    :param name: String containing the name of the attribute
+    :return: Class of the attribute
+    """
+    if name in ("Dwelling", "CityVillageGraph"):
+        import cityvillage
+
+        return getattr(cityvillage, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@dataclass
+class SimSettings:
+    """
+    Data class used for the general settings of the simulation
+    Here the baseline parameter should be set
+    """
+    city_size = 40  # Number of nodes in the city
+    village_size = 10  # Number of nodes in the villages
+    nr_villages = 5  # Number of villages
+    spreading_prob = .8  # Baseline spreading probability
+    time_out = False  # Set to True to use the time_out method for spreading
+    decay = True  # Set to True to use the decay method for spreading
+    spreading_time = 2  # Only relevant if time_out set to True, number of iterations a node spreads information
+    num_start_points = 1  # Number of starting points (baseline)
+    only_villages = True  # If True, starting points are only spawned in villages
+    only_cities = False  # If True, starting points are only spawned in the city
+    seed = 60  # random seed for simulation
+    connect_prob_city = 0.5  # Probability of city nodes connected with each other
+    connect_prob_vil = 0.5  # Probability of villages nodes connected with each other
+    decay_param = -0.025  # Parameter for the decrease of the spreading_probability, only used when decay True
+    loadSim = False  # If True, just load the already calculated data and produce plots
+    runs = 1  # Number of runs to perform, if > 1 plotting will be disabled
+    max_iterations = 30  # Maximum number of spreading iterations of a run
+    debug_output = False  # If True, the city, villages and combined graph are written to output.txt
+    workers = None  # Number of worker processes for the experiments, None uses all cores
+    resume = True  # If True, an interrupted experiment continues from the results stored in csv/{seed}/store
+    topology_cache_size = 32  # Number of networks kept in memory per worker, reused by runs with the same network
+    topology_cache_dir = None  # Optional directory where the cached networks are stored, e.g. "cache/topologies"
+    graph_path = None  # Optional directory of a network stored with graphstore.py, used instead of creating networks
+    instrument = False  # If True, the time of every phase and counters of every run are written to csv/{seed}/metrics
+    profile = None  # Set to "cprofile" or "tracemalloc" to profile the experiments, written to csv/{seed}/profile.*
+    render_workers = 1  # Number of processes rendering the gif of a single experiment, None uses all cores
+    sweep_spec = None  # Optional path of a JSON sweep specification (see design.py), replaces the Experiments
+    adaptive = False  # If True, runs are added to every experiment until its mean time is precise, instead of runs
+    adaptive_batch = 5  # Number of runs added to an experiment at once in adaptive mode
+    adaptive_tolerance = 0.5  # Half width of the confidence interval of the mean time at which an experiment stops
+    adaptive_confidence = 0.95  # Confidence level of the confidence interval
+    adaptive_min_runs = 10  # Minimum number of runs per experiment in adaptive mode
+    adaptive_max_runs = 100  # Maximum number of runs per experiment in adaptive mode
+    adaptive_budget = None  # Optional maximum number of runs of all experiments together in adaptive mode
+
+
+@dataclass
+class Experiments:
+    """
+    Data class for the parameter ranges run through in the experiments
+    """
+
+    singleExperiment = False  # If True only run one experiment
+    decay = [True, False]
+    time_out = [False, True]
+    spreading_method = [decay, time_out]
+    spreading_method_names = ['decay', 'timeout']
+
+    spreading_prob = [0.15, 0.3, 0.6, 0.8, 0.9]
+    spreading_time = [0, 1, 2, 5, 10]
+    connect_prob_city = [0.1, 0.25, 0.5, 0.75, 1]
+    connect_prob_vil = [0.1, 0.25, 0.5, 0.75, 1]
+    parameters = [spreading_prob, spreading_time, connect_prob_city, connect_prob_vil]
+    parameter_names = ["spreading_prob", "spreading_time", "connect_prob_city", "connect_prob_vil"]
+
+    num_start_points = [1, 5]
+    only_villages = [True, False]
+    only_cities = [True, False]
+    # vector representation situation [num_start, only_vil, only_cit]
+    situation1 = [0, 0, 1]  # 1 start village
+    situation2 = [0, 1, 0]  # 1 start city
+    situation3 = [1, 0, 1]  # 5 start village
+    situation4 = [1, 1, 0]  # 5 start city
+    situation5 = [1, 1, 1]  # 5 start combined
+    situations = [situation1, situation2, situation3, situation4, situation5]
+    situation_name = ["Village", "City", "MultVillage", "MultCity", "MultVillage&City"]
+
+
+def spawn_rngs(seed_sequence, number):
+    """
+    Creates independent random generators, one per replicate
+    :param seed_sequence: np.random.SeedSequence the generators are spawned from
+    :param number: Int indicating the number of generators
+    :return: List of np.random.Generator objects
+    """
+    return [np.random.default_rng(child) for child in seed_sequence.spawn(number)]
+
+
+def build_graph(config: SimSettings, rng):
+    """
+    Creates the villages, the city and the combined graph
+    :param config: SimSettings object that determines all parameters of the simulation
+    :param rng: np.random.Generator used to create the graph
+    :return: CityVillageGraph object
+    """
+    from cityvillage import Dwelling, CityVillageGraph
+
+    villages = [Dwelling(number_nodes=config.village_size, prob=config.connect_prob_vil, rng=rng)
+                for _ in range(config.nr_villages)]
+    city = Dwelling(number_nodes=config.city_size, prob=config.connect_prob_city, rng=rng)
+    graph = CityVillageGraph(time_out=config.time_out, spreading_time=config.spreading_time)
+    debug_file = './output.txt' if config.debug_output else None
+    return graph.add_dwellings(city, villages, rng=rng, debug_file=debug_file)
+
+
+def build_topology(config: SimSettings, rng):
+    """
+    Creates the compact topology of the network of the city and the villages, the same network build_graph creates
+    from the same generator state. If graph_path is set, the stored network is memory mapped instead
+    :param config: SimSettings object that determines all parameters of the simulation
+    :param rng: np.random.Generator used to create the network
+    :return: CityVillageTopology object
+    """
+    if config.graph_path is not None:
+        topology = load_graph(config.graph_path)
+        sizes = [config.city_size] + [config.village_size] * config.nr_villages
+        if not np.array_equal(np.diff(topology.offsets), sizes):
+            raise ValueError(f"The network in {config.graph_path} does not match city_size, village_size and "
+                             f"nr_villages of the SimSettings")
+    else:
+        topology = CityVillageTopology.generate(config.city_size, config.village_size, config.nr_villages,
+                                                config.connect_prob_city, config.connect_prob_vil, rng=rng)
+    if config.debug_output:
+        with open('./output.txt', 'w') as f:
+            print(topology.to_igraph(), file=f)
+    return topology
+
+
+def topology_key(config: SimSettings, replicate):
+    """
+    Helper function to identify the network of a run in a TopologyCache. All runs with the same network settings, seed
+    and replicate share the network, independent of their spreading settings and start points
+    :param config: SimSettings object that determines all parameters of the simulation
+    :param replicate: Int indicating the number of the run
+    :return: Tuple used as cache key
+    """
+    return (config.city_size, config.village_size, config.nr_villages, config.connect_prob_city,
+            config.connect_prob_vil, config.seed, replicate)
+
+
+def get_start_points(config: SimSettings, rng):
+    """
+    Selects the start points of a run, based on the number and location settings. If neither only_villages nor
+    only_cities is set, every start point is in a village or the city with equal probability
+    :param config: SimSettings object that determines all parameters of the simulation
+    :param rng: np.random.Generator used to select the start points
+    :return: Array of distinct node indices
+    """
+    if config.only_villages:
+        nr_village_points = config.num_start_points
+    elif config.only_cities:
+        nr_village_points = 0
+    else:
+        nr_village_points = rng.binomial(config.num_start_points, 0.5)
+    # WARNING make sure that the city and village size is larger than the amount of starting points
+    village_points = config.city_size + rng.choice(config.village_size * config.nr_villages, size=nr_village_points,
+                                                   replace=False)
+    city_points = rng.choice(config.city_size, size=config.num_start_points - nr_village_points, replace=False)
+    return np.concatenate([village_points, city_points])
+
+
+def run_simulation(config: SimSettings, plot=False, observer=None, rng=None, topology=None, recorder=None,
+                   instrumentation=NULL_INSTRUMENTATION):
+    """
+    Main class for the simulation. Performs one run of the simulation given the parameter.
+    Without plot and observer the run is headless, i.e. nothing is plotted or written to disk
+    :param config: SimSettings object that determines all parameters of the simulation
+    :param plot: Boolean that defines whether the run should be plotted or not, if True and no observer is given
+        every iteration is rendered into information_spread.gif by a GifRenderer
+    :param observer: Optional callable observer(states, number) called with the state array of the nodes before
+        every iteration and after the last one
+    :param rng: np.random.Generator used for all random decisions of the run, seeded with config.seed if None
+    :param topology: Optional CityVillageTopology to run on, e.g. taken from a TopologyCache, a new one is created
+        with rng if None
+    :param recorder: Optional TrajectoryRecorder that records the course of the run
+    :param instrumentation: Instrumentation object that records the time of the phases of the run, the number of
+        iterations, traversed edges and nodes that changed state
+    :return:
+    """
+    rng = np.random.default_rng(config.seed) if rng is None else rng
+    if topology is None:
+        with instrumentation.phase("topology"):
+            topology = build_topology(config, rng)
+    renderer = None
+    if observer is None and plot:
+        from animation import GifRenderer
+
+        with instrumentation.phase("plotting"):
+            observer = renderer = GifRenderer(topology, workers=config.render_workers)
+    with instrumentation.phase("start_points"):
+        start_points = get_start_points(config, rng)
+
+    with instrumentation.phase("spreading"):
+        engine = SpreadingEngine(topology.indptr, topology.indices, spreading_time=config.spreading_time,
+                                 rng=rng, model=model_from_config(config))
+        engine.start_spreading(start_points)
+        if recorder is None:
+            recorder = TrajectoryRecorder(dwellings=False, infection_times=False)
+        recorder.start(engine, topology, config.max_iterations)
+    # Defines the number of iterations
+    count = 0
+    while not engine.not_spreading() and count < config.max_iterations:
+        if observer is not None:
+            with instrumentation.phase("plotting"):
+                observer(engine.states[0], count)
+        count = count + 1
+        with instrumentation.phase("spreading"):
+            engine.step()
+            recorder.record(engine, count)
+        instrumentation.count("edges_traversed", engine.edges_traversed)
+        instrumentation.count("nodes_changed", engine.informed.size + engine.stopped.size)
+    recorder.finish()
+    instrumentation.count("iterations", count)
+
+    with instrumentation.phase("plotting"):
+        if observer is not None:
+            observer(engine.states[0], count)
+        if renderer is not None:
+            renderer.close()
+        if plot:
+            from report import plot_statistics
+
+            not_interested_counts, spreading_counts, ignorant_counts = recorder.counts[0, :count + 1].T.tolist()
+            plot_statistics(not_interested_counts, spreading_counts, ignorant_counts)
+    return count
+
+
+def run_batch(config: SimSettings, replicates, same_graph=True, seed_sequence=None, recorder=None, topologies=None):
+    """
+    Performs several independent runs of the simulation at once. All replicates advance together in one state
+    matrix and every replicate stops on its own, when no node is spreading or max_iterations is reached
+    :param config: SimSettings object that determines all parameters of the simulation
+    :param replicates: Int indicating the number of runs to perform
+    :param same_graph: Boolean, if True all replicates run on the same graph, otherwise every replicate gets its own
+        graph created with the same settings
+    :param seed_sequence: np.random.SeedSequence the random generators of the batch and of every replicate are
+        spawned from, created from config.seed if None
+    :param recorder: Optional TrajectoryRecorder that records the course of all replicates
+    :param topologies: Optional list of CityVillageTopology objects, one per replicate, e.g. taken from a
+        TopologyCache, used instead of creating the graphs
+    :return: Tuple (stop_times, trajectories), stop_times is an array of shape (replicates,) with the number of
+        iterations of every run, trajectories is an array of shape (replicates, max_iterations + 1, 3) with the
+        number of not_interested, spreading and ignorant nodes after every iteration
+    """
+    seed_sequence = np.random.SeedSequence(config.seed) if seed_sequence is None else seed_sequence
+    # The first generator drives the spreading of the whole batch, the others the set up of every replicate
+    rng, *replicate_rngs = spawn_rngs(seed_sequence, replicates + 1)
+    if topologies is None and not same_graph:
+        topologies = [build_topology(config, replicate_rng) for replicate_rng in replicate_rngs]
+    if topologies is None:
+        topology = build_topology(config, rng)
+        engine = BatchSpreadingEngine(topology.indptr, topology.indices, replicates=replicates,
+                                      spreading_time=config.spreading_time, rng=rng, model=model_from_config(config))
+    else:
+        topology = topologies[0]
+        engine = BatchSpreadingEngine.from_topologies(topologies, spreading_time=config.spreading_time, rng=rng,
+                                                      model=model_from_config(config))
+    engine.start_spreading([get_start_points(config, replicate_rng) for replicate_rng in replicate_rngs])
+
+    if recorder is None:
+        recorder = TrajectoryRecorder(dwellings=False, infection_times=False)
+    recorder.start(engine, topology, config.max_iterations)
+    count = 0
+    while engine.spreading().any() and count < config.max_iterations:
+        count = count + 1
+        engine.step()
+        recorder.record(engine, count)
+    recorder.finish()
+    return recorder.stop_times, recorder.counts
+
+
+def get_row_dict(config, time, situation):
+    """
+    Helper function to generate a dictionary row
+    :param config: SimSettings object containing all the parameter
+    :param time: Int indicating the iteration
+    :return: Dictionary used for pandas DataFrame generation
+    """
+    row = {"time": time, "situation": situation, "spreading_prob": config.spreading_prob, "time_out": config.time_out,
+           "decay": config.decay,
+           "connect_prob_city": config.connect_prob_city, "connect_prob_vil": config.connect_prob_vil,
+           "num_start_points": config.num_start_points, "only_cities": config.only_cities,
+           "only_villages": config.only_villages, "spreading_time": config.spreading_time}
+    return row
+
+
+def print_header(header):
+    """
+    Short helper function to print nice header output
+    :param header: String that is to be printed with a header
+    :return:
+    """
+    print('-' * 50)
+    print(header)
+
+
+# Settings that accept None although their default is not None, parsed as literals instead of the type of the default
+_OPTIONAL_SETTINGS = ("render_workers",)
+# Dashed command line names of the settings that are not written in snake case
+_ALIASES = {"loadSim": "--load-sim"}
+
+
+def _parse_bool(text):
+    """
+    Helper function to parse a boolean command line argument
+    :param text: String such as True, false, 1 or no
+    :return: Boolean
+    """
+    if text.lower() in ("true", "1", "yes"):
+        return True
+    if text.lower() in ("false", "0", "no"):
+        return False
+    raise argparse.ArgumentTypeError(f"{text} is not a boolean")
+
+
+def _parse_literal(text):
+    """
+    Helper function to parse a command line argument into a Python literal, e.g. a number, None or a boolean
+    :param text: String of the argument
+    :return: Parsed value, the string itself if it is no literal
+    """
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def parse_settings(argv=None):
+    """
+    Creates the settings of the simulation from command line arguments instead of edits to the data classes. Every
+    setting of the SimSettings can be replaced, e.g. --city-size 1000 --time-out true --graph-path graphs/large, and
+    --vary replaces the parameters varied in the experiments, e.g. --vary spreading_prob 0.2 0.4 --vary
+    spreading_time 1 5
+    :param argv: Optional list of argument strings, the arguments of the program if None
+    :return: Tuple (SimSettings, Experiments)
+    """
+    parser = argparse.ArgumentParser(description="Runs the experiments of the information spreading simulation")
+    for name, default in vars(SimSettings).items():
+        if name.startswith("_"):
+            continue
+        if isinstance(default, bool):
+            value_type = _parse_bool
+        elif isinstance(default, (int, float, str)) and name not in _OPTIONAL_SETTINGS:
+            value_type = type(default)
+        else:
+            value_type = _parse_literal
+        flags = [f"--{name.replace('_', '-')}"] + ([_ALIASES[name]] if name in _ALIASES else [])
+        # Settings that are not given are left out, so a given None replaces the default
+        parser.add_argument(*flags, type=value_type, dest=name, default=argparse.SUPPRESS,
+                            help=f"replaces {name} of the SimSettings")
+    parser.add_argument("--single-experiment", action="store_true", dest="singleExperiment",
+                        help="only run one experiment and render it into information_spread.gif")
+    parser.add_argument("--vary", nargs="+", action="append", metavar=("NAME", "VALUE"),
+                        help="varies a parameter of the SimSettings over the given values, replaces the parameters "
+                             "of the Experiments")
+    args = parser.parse_args(argv)
+
+    config = SimSettings()
+    for name, value in vars(args).items():
+        if name not in ("singleExperiment", "vary"):
+            setattr(config, name, value)
+    experiments = Experiments()
+    experiments.singleExperiment = args.singleExperiment or experiments.singleExperiment
+    if args.vary:
+        for name, *values in args.vary:
+            if not hasattr(SimSettings, name) or not values:
+                parser.error(f"--vary needs a setting of the SimSettings and at least one value, got {name}")
+        experiments.parameter_names = [name for name, *_ in args.vary]
+        experiments.parameters = [[_parse_literal(value) for value in values] for _, *values in args.vary]
+    if config.adaptive and config.instrument:
+        parser.error("instrument cannot be used in the adaptive mode, its runs are not measured one by one")
+    return config, experiments
+
+
+def run_experiments(config: SimSettings, experiments: Experiments, instrumentation=NULL_INSTRUMENTATION):
+    """
+    Runs the experiments, described by the sweep specification of config.sweep_spec or by the Experiments, stores
+    the results in csv/{seed}/store and exports them to CSV files in csv/{seed}
+    :param config: SimSettings object that contains the baseline parameters
+    :param experiments: Experiments object that contains the parameter ranges
+    :param instrumentation: Instrumentation object that records the time of the simulation and the CSV output
+    :return: Tuple (spec, exported) of the SweepSpec and the list of exported (parameter_name,
+        spreading_method_name) tuples
+    """
+    from design import SweepSpec
+    from results import ResultSink, sweep_fingerprint
+    from sweep import build_cells, run_adaptive_sweep, run_sweep
+
+    if config.adaptive and config.instrument:
+        # The adaptive sweep runs whole batches at once with run_batch, which has no per run metrics
+        raise ValueError("instrument cannot be used in the adaptive mode, its runs are not measured one by one")
+    store = f"csv/{config.seed}/store"
+    if not config.resume:
+        ResultSink(store).clear()
+    spec = SweepSpec.load(config.sweep_spec, config, experiments) if config.sweep_spec is not None else \
+        SweepSpec.from_experiments(config, experiments)
+    sink = ResultSink(store, fingerprint=sweep_fingerprint(config, build_cells(spec) if config.adaptive else
+                                                           spec.tasks()))
+    with instrumentation.phase("simulation"):
+        if config.adaptive:
+            cells = run_adaptive_sweep(config, spec, sink, max_workers=config.workers)
+            print_header("Runs per experiment")
+            for cell in build_cells(spec):
+                runs, mean, half_width = cells[cell.index]
+                point = ", ".join(f"{parameter.name}={cell.settings[parameter.name]}"
+                                  for parameter in spec.parameters if parameter.name in cell.settings)
+                print(f"{point} {cell.spreading_method_name} {cell.situation_name}: {runs} runs, "
+                      f"time {mean:.2f} +- {half_width:.2f}")
+        else:
+            run_sweep(config, spec, sink, max_workers=config.workers)
+    with instrumentation.phase("csv_output"):
+        exported = sink.export_csv(f"csv/{config.seed}", [parameter.name for parameter in spec.parameters])
+    return spec, exported
+
+
+if __name__ == '__main__':
+    # Runs the experiments without plotting, see main.py for the complete program
+    cfg, exp = parse_settings()
+    if exp.singleExperiment:
+        print(run_simulation(cfg))
+    else:
+        instrumentation = get_instrumentation(cfg)
+        with profile(cfg.profile, f"csv/{cfg.seed}/profile"):
+            run_experiments(cfg, exp, instrumentation)
+        if cfg.instrument:
+            print_header("Time per phase")
+            print(instrumentation.report())
@@ -0,0 +1,298 @@
+import numpy as np
+
+from models import SpreadingModel, TimeoutModel
+from topology import csr_neighbours
+
+# Integer codes of the node states, the index into STATE_NAMES gives the name used by CityVillageGraph
+IGNORANT = 0
+SPREADING = 1
+NOT_INTERESTED = 2
+STATE_NAMES = ("ignorant", "spreading", "not_interested")
+
+
+def _unique(values):
+    """
+    Sorted unique values of an integer array, faster than np.unique for the large index arrays of the engine
+    :param values: 1-D integer array
+    :return: Sorted array without duplicates
+    """
+    values = np.sort(values)
+    return values[np.concatenate((values[:1] >= 0, values[1:] != values[:-1]))]
+
+
+class BatchSpreadingEngine:
+    """
+    Array backed spreading engine for a batch of independent replicates. Keeps the node states of all replicates
+    in an R x N NumPy int8 matrix and the adjacency as CSR index arrays, so that one iteration of spreading in all
+    replicates is a handful of batched array operations.
+    The engine keeps the set of spreading nodes (the frontier) and running counts of the nodes in every state, so an
+    iteration only touches the frontier and its edges and the termination check does not scan the states.
+    The dynamics of the spreading, i.e. the probability of informing a neighbour and when nodes stop spreading, are
+    given by a SpreadingModel
+    """
+
+    def __init__(self, indptr, indices, replicates=1, spreading_time=5, time_out=True, number_nodes=None, rng=None,
+                 model=None):
+        """
+        Constructor that sets all nodes of all replicates to the ignorant state
+        :param indptr: CSR index pointer array, either of the graph shared by all replicates or of the disjoint
+            union of one graph per replicate
+        :param indices: CSR neighbour array matching indptr
+        :param replicates: Int indicating the number of replicates R
+        :param spreading_time: Int indicating the time a node spreads if in spreading state and neighbours are in
+            ignorant state
+        :param time_out: Boolean indicating whether nodes stop spreading after some iterations or not
+        :param number_nodes: Int indicating the number of nodes N per replicate, defaults to the size of the CSR graph
+        :param rng: np.random.Generator used for spreading, a new unseeded one if None
+        :param model: SpreadingModel of the dynamics, if None a TimeoutModel with spreading_time if time_out is used
+            and a SpreadingModel otherwise
+        """
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices)
+        if model is None:
+            model = TimeoutModel(spreading_time=spreading_time) if time_out else SpreadingModel()
+        self.model = model
+        self.spreading_time = spreading_time
+        self.replicates = replicates
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.graph_nodes = self.indptr.size - 1
+        self.number_nodes = self.graph_nodes if number_nodes is None else number_nodes
+        self.states = np.full((replicates, self.number_nodes), IGNORANT, dtype=np.int8)
+        self.time = np.full((replicates, self.number_nodes), spreading_time, dtype=np.int16)
+        self.frontier = np.zeros(0, dtype=np.int64)
+        self.state_counts = np.zeros((replicates, 3), dtype=np.int32)
+        # Flat indices of the nodes that were informed and that stopped spreading in the last iteration
+        self.informed = np.zeros(0, dtype=np.int64)
+        self.stopped = np.zeros(0, dtype=np.int64)
+        # Number of edges from spreading nodes that were looked at in the last iteration
+        self.edges_traversed = 0
+        # Number of iterations run so far
+        self.iteration = 0
+        # Lowest index of a node that informed every node in the current iteration, within its replicate. Only the
+        # entries of the nodes informed in an iteration are set, they are reset at the end of the iteration
+        dtype = np.int32 if self.number_nodes < np.iinfo(np.int32).max else np.int64
+        self.informer = np.full(replicates * self.number_nodes, np.iinfo(dtype).max, dtype=dtype)
+        self.model.start(self)
+        self.refresh()
+
+    @classmethod
+    def from_topologies(cls, topologies, spreading_time=5, time_out=True, rng=None, model=None):
+        """
+        Creates an engine with one replicate per topology, all topologies need to have the same number of nodes
+        :param topologies: List of CityVillageTopology objects
+        :param spreading_time: Int indicating the time a node spreads if in spreading state and neighbours are in
+            ignorant state
+        :param time_out: Boolean indicating whether nodes stop spreading after some iterations or not
+        :param rng: np.random.Generator used for spreading, a new unseeded one if None
+        :param model: SpreadingModel of the dynamics, see the constructor
+        :return: BatchSpreadingEngine
+        """
+        number_nodes = topologies[0].number_nodes
+        if any(topology.number_nodes != number_nodes for topology in topologies):
+            raise ValueError("All graphs of a batch need to have the same number of nodes")
+        # Disjoint union of all graphs, node i of replicate r gets index r * number_nodes + i
+        edge_offsets = np.cumsum([0] + [topology.indices.size for topology in topologies])
+        indptr = np.concatenate([topology.indptr[:-1] + offset for topology, offset in zip(topologies, edge_offsets)]
+                                + [edge_offsets[-1:]])
+        dtype = np.int32 if len(topologies) * number_nodes <= np.iinfo(np.int32).max else np.int64
+        indices = np.concatenate([topology.indices.astype(dtype) + dtype(r * number_nodes)
+                                  for r, topology in enumerate(topologies)])
+        return cls(indptr, indices, replicates=len(topologies), spreading_time=spreading_time, time_out=time_out,
+                   number_nodes=number_nodes, rng=rng, model=model)
+
+    def start_spreading(self, nodes):
+        """
+        Sets the given nodes to the spreading state
+        :param nodes: Array-like of shape (R, k) with the start nodes of every replicate, or of shape (k,) to use the
+            same start nodes in every replicate
+        :return:
+        """
+        nodes = np.broadcast_to(np.asarray(nodes, dtype=np.int64), (self.replicates, np.shape(nodes)[-1]))
+        self.states[np.arange(self.replicates)[:, None], nodes] = SPREADING
+        self.refresh()
+
+    def refresh(self):
+        """
+        Recomputes the frontier and the state counts from the state matrix, needed after the states were changed
+        directly instead of through start_spreading or step
+        :return:
+        """
+        self.frontier = np.flatnonzero(self.states.reshape(-1) == SPREADING)
+        self.state_counts = np.stack([(self.states == state).sum(axis=1)
+                                      for state in (NOT_INTERESTED, SPREADING, IGNORANT)], axis=1).astype(np.int32)
+
+    def counts(self):
+        """
+        Counts the nodes in every state for every replicate
+        :return: Array of shape (R, 3) with the number of not_interested, spreading and ignorant nodes per replicate
+        """
+        return self.state_counts.copy()
+
+    def spreading(self):
+        """
+        Checks for every replicate whether there are still spreading nodes
+        :return: Boolean array of shape (R,)
+        """
+        return self.state_counts[:, 1] > 0
+
+    def _neighbours(self, nodes):
+        """
+        Helper function to gather the neighbours of nodes of any replicate
+        :param nodes: Array of flat node indices
+        :return: Tuple (src, neighbours) as returned by csr_neighbours, with flat neighbour indices
+        """
+        if self.graph_nodes == self.states.size:
+            return csr_neighbours(self.indptr, self.indices, nodes)
+        # Look up neighbours in the shared graph and shift them back to the replicate of the node
+        local = nodes % self.graph_nodes
+        src, neighbours = csr_neighbours(self.indptr, self.indices, local)
+        return src, neighbours + (nodes - local)[src]
+
+    def step(self, spread_prob=None):
+        """
+        Runs one iteration of spreading information in all replicates. Within an iteration the nodes act one after
+        the other in the order of their index: a spreading node becomes not_interested if the stopping kernel of the
+        model says so, by default if none of its neighbours is ignorant at that moment, and tries to inform every
+        ignorant neighbour with the probability given by the transmission kernel of the model. A node informed by a
+        node with a lower index acts later in the same iteration, but cannot become not_interested in it.
+        The order is followed with waves: a node is informed by the lowest index among its neighbours that succeed,
+        so the trials of all acting nodes are drawn at once, and the nodes informed by a lower index act in the next
+        wave, until no more nodes are informed that way
+        :param spread_prob: Optional float, or array of shape (R,), indicating the spreading probability for this
+            iteration instead of the probability of the model
+        :return: Tuple of two arrays of shape (R,) indicating the number of nodes that became not_interested and
+            spreading in every replicate
+        """
+        states = self.states.reshape(-1)
+        spreaders = self.frontier
+        if not spreaders.size:
+            self.informed, self.stopped = spreaders, spreaders
+            self.edges_traversed = 0
+            return np.zeros(self.replicates, dtype=np.int64), np.zeros(self.replicates, dtype=np.int64)
+
+        wave = spreaders
+        waves = []
+        informed = []
+        self.edges_traversed = 0
+        while wave.size:
+            src, neighbours = self._neighbours(wave)
+            self.edges_traversed += neighbours.size
+            # The states are only written after the last wave, so ignorant means ignorant at the start
+            ignorant = states[neighbours] == IGNORANT
+            if not waves:
+                first_src, first_targets = src[ignorant], neighbours[ignorant]
+            waves.append(wave)
+            # One trial per edge between an acting and an ignorant node
+            senders, targets = wave[src[ignorant]], neighbours[ignorant]
+            prob = self.model.transmission(self, senders, targets, spread_prob)
+            success = self.rng.random(targets.size) < prob
+            senders, targets = senders[success] % self.number_nodes, targets[success]
+            reached = _unique(targets)
+            before = self.informer[reached].copy()
+            np.minimum.at(self.informer, targets, senders.astype(self.informer.dtype))
+            position = reached % self.number_nodes
+            # Nodes whose informer has a lower index act in this iteration, every node acts once
+            wave = reached[(self.informer[reached] < position) & (before >= position)]
+            informed.append(reached)
+        informed = _unique(np.concatenate(informed))
+
+        # A spreading node decides whether to stop before its own trials, so it sees the neighbours informed by nodes
+        # with a lower index as not ignorant anymore and those informed by itself or higher indices as ignorant
+        still_ignorant = self.informer[first_targets] >= spreaders[first_src] % self.number_nodes
+        has_ignorant = np.bincount(first_src[still_ignorant], minlength=spreaders.size) > 0
+        # Nodes informed in this iteration act as well, but do not stop in it
+        acting = np.concatenate(waves)
+        has_ignorant = np.concatenate([has_ignorant, np.ones(acting.size - spreaders.size, dtype=bool)])
+        stop_mask = self.model.stopping(self, acting, has_ignorant)[:spreaders.size]
+        stop = spreaders[stop_mask]
+        self.informer[informed] = np.iinfo(self.informer.dtype).max
+
+        states[stop] = NOT_INTERESTED
+        states[informed] = SPREADING
+        # informed nodes were ignorant, so they cannot already be part of the frontier
+        self.frontier = np.concatenate([spreaders[~stop_mask], informed])
+        self.informed, self.stopped = informed, stop
+        new_not_interested = np.bincount(stop // self.number_nodes, minlength=self.replicates)
+        new_spreading = np.bincount(informed // self.number_nodes, minlength=self.replicates)
+        self.state_counts[:, 0] += new_not_interested
+        self.state_counts[:, 1] += new_spreading - new_not_interested
+        self.state_counts[:, 2] -= new_spreading
+        self.iteration += 1
+        self.model.advance(self, self.iteration)
+        return new_not_interested, new_spreading
+
+
+class SpreadingEngine(BatchSpreadingEngine):
+    """
+    Array backed spreading engine for a single run on one graph
+    """
+
+    def __init__(self, indptr, indices, spreading_time=5, time_out=True, rng=None, model=None):
+        """
+        Constructor that sets all nodes to the ignorant state
+        :param indptr: CSR index pointer array of the graph
+        :param indices: CSR neighbour array of the graph
+        :param spreading_time: Int indicating the time a node spreads if in spreading state and neighbours are in
+            ignorant state
+        :param time_out: Boolean indicating whether nodes stop spreading after some iterations or not
+        :param rng: np.random.Generator used for spreading, a new unseeded one if None
+        :param model: SpreadingModel of the dynamics, see BatchSpreadingEngine
+        """
+        super().__init__(indptr, indices, replicates=1, spreading_time=spreading_time, time_out=time_out, rng=rng,
+                         model=model)
+
+    @classmethod
+    def from_graph(cls, graph, rng=None):
+        """
+        Creates an engine from a CityVillageGraph, taking over the state and time attributes of its nodes
+        :param graph: CityVillageGraph object with initialised node properties
+        :param rng: np.random.Generator used for spreading, a new unseeded one if None
+        :return: SpreadingEngine
+        """
+        indptr, indices = graph.to_csr()
+        engine = cls(indptr, indices, spreading_time=graph.spreading_time, time_out=graph.time_out, rng=rng)
+        if graph.vcount():
+            engine.states[0] = [STATE_NAMES.index(state) for state in graph.vs["state"]]
+            engine.time[0] = graph.vs["time"]
+            engine.refresh()
+        return engine
+
+    def write_back(self, graph):
+        """
+        Writes the state and time of every node back to the attributes of a CityVillageGraph
+        :param graph: CityVillageGraph object the engine was created from
+        :return:
+        """
+        graph.vs["state"] = self.state_names()
+        graph.vs["time"] = self.time[0].tolist()
+
+    def state_names(self):
+        """
+        Helper function to get the states as strings, as used in the CityVillageGraph attributes
+        :return: List of state names
+        """
+        return np.array(STATE_NAMES)[self.states[0]].tolist()
+
+    def counts(self):
+        """
+        Counts the nodes in every state
+        :return: List of integers indicating the number of not_interested, spreading and ignorant nodes
+        """
+        return super().counts()[0].tolist()
+
+    def not_spreading(self):
+        """
+        Checks whether all nodes stopped spreading in the graph
+        :return: Boolean
+        """
+        return self.state_counts[0, 1] == 0
+
+    def step(self, spread_prob=None):
+        """
+        Runs one iteration of spreading information, see BatchSpreadingEngine.step
+        :param spread_prob: Optional float indicating the spreading probability for this iteration instead of the
+            probability of the model
+        :return: Tuple of integers indicating the number of nodes that became not_interested and spreading
+        """
+        new_not_interested, new_spreading = super().step(spread_prob)
+        return int(new_not_interested[0]), int(new_spreading[0])
@@ -0,0 +1,264 @@
+import copy
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+from functools import partial
+
+import numpy as np
+
+from design import SweepSpec, SweepTask  # noqa: F401 SweepTask is part of the interface of the sweep
+from instrument import METRIC_PREFIX, get_instrumentation
+from simulation import run_simulation, run_batch, get_row_dict, topology_key
+from topology import TopologyCache
+
+# Cache of the networks of the current process, created by the first task
+_topology_cache = None
+
+
+def build_tasks(config, experiments):
+    """
+    Turns the parameter grid of the experiments into a list of independent tasks. The tasks are ordered like the
+    rows of the result CSV files and every task gets its own seed spawned from config.seed, so the results do not
+    depend on the number of workers
+    :param config: SimSettings object that contains the baseline parameters
+    :param experiments: Experiments object that contains the parameter ranges
+    :return: List of SweepTask objects
+    """
+    return list(SweepSpec.from_experiments(config, experiments).tasks())
+
+
+def get_topology_cache(config):
+    """
+    Helper function to get the topology cache of the current process, every worker process keeps its own
+    :param config: SimSettings object that contains the cache settings
+    :return: TopologyCache object
+    """
+    global _topology_cache
+    if _topology_cache is None:
+        _topology_cache = TopologyCache(max_size=config.topology_cache_size, directory=config.topology_cache_dir)
+    return _topology_cache
+
+
+def task_row(config, time, task):
+    """
+    Helper function to generate the dictionary row of a run, the columns of get_row_dict extended by the settings of
+    the task that get_row_dict does not contain
+    :param config: SimSettings object of the run
+    :param time: Int indicating the iteration the run stopped in
+    :param task: SweepTask object of the run
+    :return: Dictionary used for pandas DataFrame generation
+    """
+    row = get_row_dict(config, time, task.situation_name)
+    for name in task.settings:
+        row.setdefault(name, getattr(config, name))
+    return row
+
+
+def run_task(config, task):
+    """
+    Runs the simulation of a single task. The network is taken from the topology cache and only depends on the
+    network settings, the seed and the run, so all spreading methods, situations and spreading parameters of a run
+    are compared on the same network. With graph_path set, all tasks run on the stored network
+    :param config: SimSettings object that contains the baseline parameters
+    :param task: SweepTask object
+    :return: Dictionary row as generated by get_row_dict, with the metrics of the run if instrument is set
+    """
+    sim_cfg = copy.deepcopy(config)
+    for name, value in task.settings.items():
+        setattr(sim_cfg, name, value)
+    instrumentation = get_instrumentation(sim_cfg)
+    with instrumentation.phase("topology"):
+        topology = None if sim_cfg.graph_path is not None else get_topology_cache(sim_cfg).get(
+            topology_key(sim_cfg, task.run))
+    time = run_simulation(sim_cfg, rng=np.random.default_rng(task.seed), topology=topology,
+                          instrumentation=instrumentation)
+    row = task_row(sim_cfg, time, task)
+    row.update({f"{METRIC_PREFIX}{name}": value for name, value in instrumentation.metrics().items()})
+    return row
+
+
+def run_sweep(config, spec, sink, max_workers=None, batch_size=1000):
+    """
+    Runs all tasks of a sweep that are not yet stored in the sink in a process pool. The tasks are generated lazily
+    and run batch by batch, the results are appended to the sink as the batches finish, so an interrupted sweep can
+    be resumed and large designs never have to be held in memory
+    :param config: SimSettings object that contains the baseline parameters
+    :param spec: SweepSpec object describing the sweep
+    :param sink: ResultSink object the results are written to
+    :param max_workers: Int indicating the number of worker processes, None uses all cores and 1 runs the tasks in
+        the current process
+    :param batch_size: Int indicating the number of tasks whose results are written at once
+    :return: Int indicating the number of tasks that were run
+    """
+    import tqdm
+
+    completed = sink.completed()
+    tasks = (task for task in spec.tasks() if task.index not in completed)
+    worker = partial(run_task, config)
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers != 1 else None
+    number_tasks = 0
+    try:
+        with tqdm.tqdm(total=len(spec), initial=len(completed)) as progress:
+            while batch := list(itertools.islice(tasks, batch_size)):
+                if executor is None:
+                    rows = list(map(worker, batch))
+                else:
+                    chunksize = max(1, len(batch) // (4 * max_workers))
+                    rows = list(executor.map(worker, batch, chunksize=chunksize))
+                sink.append(batch, rows)
+                progress.update(len(batch))
+                number_tasks += len(batch)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return number_tasks
+
+
+def run_cell_batch(config, cell, start, size):
+    """
+    Runs a batch of runs of one cell of the adaptive sweep at once with run_batch. Run r of every cell uses the network
+    of run r of the topology cache, so all cells are compared on the same networks. With graph_path set, all runs
+    share the stored network, which is memory mapped once per batch
+    :param config: SimSettings object that contains the baseline parameters
+    :param cell: SweepTask object of the cell
+    :param start: Int indicating the number of the first run of the batch
+    :param size: Int indicating the number of runs
+    :return: List of dictionary rows as generated by get_row_dict, one per run
+    """
+    sim_cfg = copy.deepcopy(config)
+    for name, value in cell.settings.items():
+        setattr(sim_cfg, name, value)
+    topologies = None if sim_cfg.graph_path is not None else [
+        get_topology_cache(sim_cfg).get(topology_key(sim_cfg, run)) for run in range(start, start + size)]
+    seed = np.random.SeedSequence(cell.seed.entropy, spawn_key=cell.seed.spawn_key + (start,))
+    stop_times, _ = run_batch(sim_cfg, size, same_graph=sim_cfg.graph_path is not None, seed_sequence=seed,
+                              topologies=topologies)
+    return [task_row(sim_cfg, int(time), cell) for time in stop_times]
+
+
+def student_t_quantile(confidence, df):
+    """
+    Two-sided quantile of the Student t distribution, i.e. the t with P(|T| < t) = confidence. P(|T| < t) has a
+    closed form for integer degrees of freedom (Abramowitz and Stegun 26.7.3), which is inverted by bisection
+    :param confidence: Float indicating the confidence level
+    :param df: Int indicating the degrees of freedom
+    :return: Float
+    """
+    def coverage(t):
+        theta = math.atan(t / math.sqrt(df))
+        cos2 = math.cos(theta) ** 2
+        if df % 2:
+            term = total = math.cos(theta) if df > 1 else 0.0
+            for k in range(1, (df - 1) // 2):
+                term *= cos2 * 2 * k / (2 * k + 1)
+                total += term
+            return 2 / math.pi * (theta + math.sin(theta) * total)
+        term = total = 1.0
+        for k in range(df // 2 - 1):
+            term *= cos2 * (2 * k + 1) / (2 * k + 2)
+            total += term
+        return math.sin(theta) * total
+
+    low, high = 0.0, 1.0
+    while coverage(high) < confidence:
+        low, high = high, 2 * high
+    for _ in range(60):
+        middle = (low + high) / 2
+        low, high = (middle, high) if coverage(middle) < confidence else (low, middle)
+    return (low + high) / 2
+
+
+def confidence_half_width(times, confidence=0.95):
+    """
+    Half width of the Student t confidence interval of the mean of a sample
+    :param times: Array of the stop times of the runs of a cell
+    :param confidence: Float indicating the confidence level
+    :return: Float, infinite for less than two runs
+    """
+    if len(times) < 2:
+        return np.inf
+    t = student_t_quantile(confidence, len(times) - 1)
+    return t * np.std(times, ddof=1) / np.sqrt(len(times))
+
+
+def build_cells(spec):
+    """
+    Turns a sweep into the cells of the adaptive sweep, one per point, spreading method and situation
+    :param spec: SweepSpec object describing the sweep
+    :return: List of SweepTask objects with run 0, every cell has its own seed
+    """
+    return list(replace(spec, replicates=1).tasks())
+
+
+def run_adaptive_sweep(config, spec, sink, max_workers=None):
+    """
+    Runs a sweep with an adaptive number of runs per cell, i.e. per point of the design, spreading method and
+    situation. Every round adds adaptive_batch runs to every cell that has less than adaptive_min_runs runs or whose
+    confidence interval of the mean stop time is wider than adaptive_tolerance, until the cell reaches
+    adaptive_max_runs or all cells together reach
+    adaptive_budget runs, so the runs go to the cells with the most variance. When the budget does not suffice for
+    all open cells, the cells with the widest intervals relative to the tolerance come first. Run r of a cell is
+    stored as task cell.index * adaptive_max_runs + r, so an interrupted sweep continues from the stored runs
+    :param config: SimSettings object that contains the baseline parameters and adaptive settings
+    :param spec: SweepSpec object describing the sweep, its replicates are ignored
+    :param sink: ResultSink object the results are written to
+    :param max_workers: Int indicating the number of worker processes, None uses all cores and 1 runs in the current
+        process
+    :return: Dictionary mapping the cell index to a tuple (runs, mean time, confidence half width)
+    """
+    import tqdm
+
+    cells = build_cells(spec)
+    max_runs = config.adaptive_max_runs
+    times = {cell.index: [] for cell in cells}
+    stored = sink.read(columns=["task_index", "time"])
+    for index, time in zip(stored["task_index"], stored["time"]):
+        times[index // max_runs].append(time)
+    budget = np.inf if config.adaptive_budget is None else config.adaptive_budget - sum(map(len, times.values()))
+
+    max_workers = os.cpu_count() if max_workers is None else max_workers
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers != 1 else None
+    try:
+        with tqdm.tqdm(total=len(cells) * max_runs) as progress:
+            progress.update(sum(map(len, times.values())))
+            while True:
+                half_widths = {cell.index: confidence_half_width(times[cell.index], config.adaptive_confidence)
+                               for cell in cells}
+                # A cell needs adaptive_min_runs runs before its interval is trusted, e.g. a few equal times
+                # give an interval of width zero
+                open_cells = sorted((cell for cell in cells if len(times[cell.index]) < max_runs
+                                     and (len(times[cell.index]) < config.adaptive_min_runs
+                                          or half_widths[cell.index] > config.adaptive_tolerance)),
+                                    key=lambda cell: -half_widths[cell.index])
+                jobs = []
+                for cell in open_cells:
+                    size = int(min(config.adaptive_batch, max_runs - len(times[cell.index]), budget))
+                    if size <= 0:
+                        break
+                    budget -= size
+                    jobs.append((cell, len(times[cell.index]), size))
+                if not jobs:
+                    break
+                worker = partial(run_cell_batch, config)
+                if executor is None:
+                    results = list(map(worker, *zip(*jobs)))
+                else:
+                    results = list(executor.map(worker, *zip(*jobs)))
+                tasks, rows = [], []
+                for (cell, start, size), cell_rows in sorted(zip(jobs, results), key=lambda job: job[0][0].index):
+                    tasks += [SweepTask(index=cell.index * max_runs + run, parameter_name=cell.parameter_name,
+                                        spreading_method_name=cell.spreading_method_name,
+                                        situation_name=cell.situation_name, run=run, settings=cell.settings,
+                                        seed=None) for run in range(start, start + size)]
+                    rows += cell_rows
+                    times[cell.index] += [row["time"] for row in cell_rows]
+                sink.append(tasks, rows)
+                progress.update(len(rows))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return {cell.index: (len(times[cell.index]), float(np.mean(times[cell.index])) if times[cell.index] else np.nan,
+                         confidence_half_width(times[cell.index], config.adaptive_confidence)) for cell in cells}
@@ -0,0 +1,278 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+def edges_to_csr(number_nodes, edges):
+    """
+    Converts an undirected edge list into compressed sparse row (CSR) adjacency arrays.
+    Duplicate edges and self loops are dropped, so each neighbour appears once per node
+    :param number_nodes: Int indicating the number of nodes in the graph
+    :param edges: Array-like of shape (m, 2) containing the edges of the graph
+    :return: Tuple (indptr, indices), the neighbours of node i are indices[indptr[i]:indptr[i + 1]]
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    low = np.minimum(edges[:, 0], edges[:, 1])
+    high = np.maximum(edges[:, 0], edges[:, 1])
+    # Encode every edge as one integer key to drop duplicates and self loops with a single sort
+    keys = np.sort(low[low != high] * number_nodes + high[low != high])
+    keys = keys[np.concatenate((keys[:1] >= 0, keys[1:] != keys[:-1]))]
+    low, high = np.divmod(keys, number_nodes)
+    # Store every undirected edge in both directions, sorted by source node and then neighbour
+    directed = np.concatenate([keys, high * number_nodes + low])
+    directed.sort()
+    src, dst = np.divmod(directed, number_nodes)
+    indptr = np.zeros(number_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=number_nodes), out=indptr[1:])
+    indices = dst.astype(np.int32)
+    return indptr, indices
+
+
+def csr_neighbours(indptr, indices, nodes):
+    """
+    Gathers the neighbours of a set of nodes in one vectorized operation
+    :param indptr: CSR index pointer array
+    :param indices: CSR neighbour array
+    :param nodes: Array of node indices whose neighbourhoods are gathered
+    :return: Tuple (src, neighbours), where src[k] is the position in nodes that neighbours[k] belongs to
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = indptr[nodes]
+    degrees = indptr[nodes + 1] - starts
+    total = int(degrees.sum())
+    src = np.repeat(np.arange(nodes.size), degrees)
+    # Position of every gathered entry inside the neighbour list of its node
+    within = np.arange(total) - np.repeat(np.cumsum(degrees) - degrees, degrees)
+    return src, indices[np.repeat(starts, degrees) + within]
+
+
+def sample_gnp_edges(number_nodes, prob, rng=None, chunk_size=2 ** 22):
+    """
+    Samples the edges of an Erdős–Rényi G(n, p) graph, every pair of nodes is connected with probability prob.
+    Instead of one random number per pair, the gaps between consecutive edges are drawn from a geometric
+    distribution, so the cost grows with the number of edges rather than the number of node pairs
+    :param number_nodes: Int indicating the number of nodes in the graph
+    :param prob: Float that indicates the probability of two nodes being connected by an edge
+    :param rng: np.random.Generator used for sampling, a new unseeded one if None
+    :param chunk_size: Int indicating the maximum number of gaps drawn at once
+    :return: Array of shape (m, 2) with the edges (i, j), i > j
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    number_pairs = number_nodes * (number_nodes - 1) // 2
+    if prob <= 0 or number_pairs == 0:
+        keys = np.zeros(0, dtype=np.int64)
+    elif prob >= 1:
+        keys = np.arange(number_pairs, dtype=np.int64)
+    else:
+        # Pairs are numbered k = i * (i - 1) / 2 + j, the next edge lies a geometric number of pairs further
+        chunks = []
+        position = -1
+        expected = int(number_pairs * prob * 1.05) + 16
+        while position < number_pairs:
+            gaps = rng.geometric(prob, size=min(expected, chunk_size))
+            chunk = position + np.cumsum(gaps)
+            position = chunk[-1]
+            chunks.append(chunk[chunk < number_pairs])
+        keys = np.concatenate(chunks)
+    # Invert the pair numbering, correcting for floating point errors of the square root
+    i = ((1 + np.sqrt(1 + 8 * keys.astype(np.float64))) // 2).astype(np.int64)
+    i -= i * (i - 1) // 2 > keys
+    i += (i + 1) * i // 2 <= keys
+    return np.column_stack([i, keys - i * (i - 1) // 2])
+
+
+def sample_bridge_edges(offsets, number_connections, rng=None):
+    """
+    Samples the edges between the city and the villages, every village gets abs(normal(number_connections - 1))
+    + 1 edges between a random node of the village and a random node of the city
+    :param offsets: Array of the node index boundaries of the dwellings, the city holds the nodes
+        offsets[0]:offsets[1] and village v the nodes offsets[v + 1]:offsets[v + 2]
+    :param number_connections: Int to indicate the mean number of connections between the city and a village
+    :param rng: np.random.Generator used for sampling, a new unseeded one if None
+    :return: Array of shape (m, 2) with the edges (village node, city node)
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    offsets = np.asarray(offsets, dtype=np.int64)
+    sizes = np.diff(offsets)
+    nr_villages = sizes.size - 1
+    connections = np.abs(rng.normal(number_connections - 1, size=nr_villages)).astype(int) + 1
+    village_idx = np.repeat(np.arange(nr_villages), connections)
+    village_nodes = offsets[1:-1][village_idx] + rng.integers(0, sizes[1:][village_idx])
+    city_nodes = offsets[0] + rng.integers(0, sizes[0], size=village_idx.size)
+    return np.column_stack([village_nodes, city_nodes])
+
+
+class CityVillageTopology:
+    """
+    Compact topology of a network of a city and villages. Holds the dwelling boundaries, the CSR adjacency and the
+    village membership of every node as NumPy arrays, independent of igraph
+    """
+    __slots__ = ("offsets", "indptr", "indices", "village_id")
+
+    def __init__(self, offsets, indptr, indices, village_id=None):
+        """
+        Constructor that wraps existing arrays
+        :param offsets: Array of the node index boundaries of the dwellings, the city holds the nodes
+            offsets[0]:offsets[1] and village v the nodes offsets[v + 1]:offsets[v + 2]
+        :param indptr: CSR index pointer array
+        :param indices: CSR neighbour array
+        :param village_id: Array with the village of every node, -1 for city nodes, derived from offsets if None
+        """
+        self.offsets = offsets
+        self.indptr = indptr
+        self.indices = indices
+        if village_id is None:
+            sizes = np.diff(offsets)
+            dtype = np.int16 if sizes.size <= np.iinfo(np.int16).max else np.int32
+            village_id = np.repeat(np.arange(-1, sizes.size - 1, dtype=dtype), sizes)
+        self.village_id = village_id
+
+    @classmethod
+    def generate(cls, city_size, village_size, nr_villages, connect_prob_city, connect_prob_vil,
+                 number_connections=3, rng=None):
+        """
+        Creates a random network of a city and villages. Consumes the random generator in the same order as
+        creating the Dwellings and CityVillageGraph.add_dwellings, so the same generator state gives the same network
+        :param city_size: Number of nodes in the city
+        :param village_size: Number of nodes in the villages
+        :param nr_villages: Number of villages
+        :param connect_prob_city: Probability of city nodes connected with each other
+        :param connect_prob_vil: Probability of villages nodes connected with each other
+        :param number_connections: Int to indicate the mean number of connections between the city and a village
+        :param rng: np.random.Generator used for sampling, a new unseeded one if None
+        :return: CityVillageTopology
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        offsets = np.concatenate(([0], city_size + village_size * np.arange(nr_villages + 1))).astype(np.int64)
+        village_edges = [sample_gnp_edges(village_size, connect_prob_vil, rng=rng) + offset
+                         for offset in offsets[1:-1]]
+        city_edges = sample_gnp_edges(city_size, connect_prob_city, rng=rng)
+        bridges = sample_bridge_edges(offsets, number_connections, rng=rng)
+        edges = np.concatenate([city_edges] + village_edges + [bridges])
+        indptr, indices = edges_to_csr(int(offsets[-1]), edges)
+        return cls(offsets, indptr, indices)
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Creates the topology of a CityVillageGraph
+        :param graph: CityVillageGraph object after add_dwellings
+        :return: CityVillageTopology
+        """
+        sizes = [graph.city.vcount()] + [village.vcount() for village in graph.villages]
+        offsets = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        indptr, indices = graph.to_csr()
+        return cls(offsets, indptr, indices)
+
+    @property
+    def number_nodes(self):
+        """
+        Number of nodes in the network
+        :return: Int
+        """
+        return self.indptr.size - 1
+
+    @property
+    def nr_villages(self):
+        """
+        Number of villages in the network
+        :return: Int
+        """
+        return self.offsets.size - 2
+
+    def edges(self):
+        """
+        Helper function to get the undirected edge list of the network
+        :return: Array of shape (m, 2) with the edges (i, j), i < j
+        """
+        src = np.repeat(np.arange(self.number_nodes), np.diff(self.indptr))
+        keep = src < self.indices
+        return np.column_stack([src[keep], self.indices[keep]])
+
+    def to_igraph(self):
+        """
+        Helper function to convert the topology to an igraph object. Used for plotting
+        :return: igraph.Graph representation of self
+        """
+        from igraph import Graph
+
+        return Graph(n=self.number_nodes, edges=self.edges())
+
+
+class TopologyCache:
+    """
+    Least recently used cache of generated topologies, optionally persisted to disk. A topology is identified by
+    its generation parameters and a (seed, replicate) pair, from which the random generator is seeded, so the same
+    key always gives the same network
+    """
+
+    def __init__(self, max_size=32, directory=None):
+        """
+        Constructor that creates an empty cache
+        :param max_size: Int indicating the number of topologies kept in memory
+        :param directory: Optional string containing a directory where topologies are stored with graphstore, so they
+            are shared between processes and runs
+        """
+        self.max_size = max_size
+        self.directory = directory
+        self.topologies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """
+        Returns the topology of a key, generating it if it is neither in memory nor on disk
+        :param key: Tuple (city_size, village_size, nr_villages, connect_prob_city, connect_prob_vil, seed, replicate)
+        :return: CityVillageTopology
+        """
+        if key in self.topologies:
+            self.hits += 1
+            self.topologies.move_to_end(key)
+            return self.topologies[key]
+        topology = self._load(key)
+        if topology is None:
+            self.misses += 1
+            *parameters, seed, replicate = key
+            topology = CityVillageTopology.generate(*parameters, rng=np.random.default_rng([seed, replicate]))
+            self._save(key, topology)
+        else:
+            self.hits += 1
+        self.topologies[key] = topology
+        if len(self.topologies) > self.max_size:
+            self.topologies.popitem(last=False)
+        return topology
+
+    def _path(self, key):
+        """
+        Helper function to get the graph directory of a key in the cache directory
+        :param key: Tuple identifying the topology
+        :return: String containing the path
+        """
+        return os.path.join(self.directory, "_".join(str(value) for value in key))
+
+    def _load(self, key):
+        """
+        Loads the topology of a key from the cache directory as read-only memory maps
+        :param key: Tuple identifying the topology
+        :return: CityVillageTopology, or None if it is not stored
+        """
+        from graphstore import is_stored, load_graph
+
+        if self.directory is None or not is_stored(self._path(key)):
+            return None
+        return load_graph(self._path(key))
+
+    def _save(self, key, topology):
+        """
+        Stores a topology in the cache directory in the format of graphstore.save_graph
+        :param key: Tuple identifying the topology
+        :param topology: CityVillageTopology
+        :return:
+        """
+        from graphstore import save_graph
+
+        if self.directory is not None:
+            save_graph(self._path(key), topology)
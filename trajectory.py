@@ -0,0 +1,176 @@
+import numpy as np
+
+from spreading import IGNORANT
+
+
+class TrajectoryRecorder:
+    """
+    Records the course of runs of the simulation as compact arrays. For every replicate the recorder keeps the number
+    of not_interested, spreading and ignorant nodes after every iteration, optionally broken down per dwelling, and
+    optionally the iteration in which every node was informed. The arrays are allocated once when the run starts
+    and updated from the nodes that changed state in an iteration, summaries are only computed when requested
+    """
+
+    def __init__(self, dwellings=True, infection_times=True):
+        """
+        Constructor that creates an empty recorder, the arrays are allocated by start
+        :param dwellings: Boolean, if True the state counts are also recorded for the city and every village
+        :param infection_times: Boolean, if True the iteration in which every node was informed is recorded
+        """
+        self.dwellings = dwellings
+        self.infection_times = infection_times
+        self.offsets = None
+        self.counts = None  # (R, T + 1, 3) not_interested, spreading and ignorant nodes after every iteration
+        self.dwelling_counts = None  # (R, T + 1, D, 3) the same per dwelling, the city is dwelling 0
+        self.infection_time = None  # (R, N) iteration in which every node was informed, -1 if never
+        self.stop_times = None  # (R,) number of iterations of every replicate
+        self.iterations = 0
+        self._dwelling = None
+        self._current = None
+        self._active = None
+
+    def start(self, engine, topology, max_iterations):
+        """
+        Allocates the arrays and records the state of the engine before the first iteration
+        :param engine: BatchSpreadingEngine after the start points are set
+        :param topology: CityVillageTopology of the replicates, all replicates need to have the same dwellings
+        :param max_iterations: Int indicating the maximum number of iterations that will be recorded
+        :return:
+        """
+        replicates, number_nodes = engine.states.shape
+        self.offsets = np.asarray(topology.offsets)
+        self.counts = np.zeros((replicates, max_iterations + 1, 3), dtype=np.int32)
+        self.counts[:, 0] = engine.state_counts
+        self.stop_times = np.zeros(replicates, dtype=np.int32)
+        self.iterations = 0
+        self._active = engine.spreading()
+        if self.dwellings:
+            nr_dwellings = self.offsets.size - 1
+            self._dwelling = np.asarray(topology.village_id, dtype=np.int64) + 1
+            # The state codes 0, 1 and 2 map to the count columns ignorant (2), spreading (1) and not_interested (0)
+            keys = ((np.arange(replicates)[:, None] * nr_dwellings + self._dwelling) * 3 + 2 - engine.states)
+            self._current = np.bincount(keys.reshape(-1), minlength=replicates * nr_dwellings * 3).reshape(
+                replicates, nr_dwellings, 3).astype(np.int32)
+            self.dwelling_counts = np.zeros((replicates, max_iterations + 1, nr_dwellings, 3), dtype=np.int32)
+            self.dwelling_counts[:, 0] = self._current
+        if self.infection_times:
+            self.infection_time = np.full((replicates, number_nodes), -1, dtype=np.int16)
+            self.infection_time[engine.states != IGNORANT] = 0
+
+    def record(self, engine, iteration):
+        """
+        Records the state of the engine after an iteration, using the nodes that were informed and that stopped
+        spreading in this iteration
+        :param engine: BatchSpreadingEngine after calling step
+        :param iteration: Int indicating the number of the iteration, starting at 1
+        :return:
+        """
+        self.counts[:, iteration] = engine.state_counts
+        self.stop_times[self._active] = iteration
+        self._active = engine.spreading()
+        self.iterations = iteration
+        if self.dwellings:
+            replicates, nr_dwellings = self._current.shape[:2]
+            number_nodes = self._dwelling.size
+
+            def per_dwelling(nodes):
+                keys = nodes // number_nodes * nr_dwellings + self._dwelling[nodes % number_nodes]
+                return np.bincount(keys, minlength=replicates * nr_dwellings).reshape(replicates, nr_dwellings)
+
+            stopped, informed = per_dwelling(engine.stopped), per_dwelling(engine.informed)
+            self._current[..., 0] += stopped
+            self._current[..., 1] += informed - stopped
+            self._current[..., 2] -= informed
+            self.dwelling_counts[:, iteration] = self._current
+        if self.infection_times:
+            self.infection_time.reshape(-1)[engine.informed] = iteration
+
+    def finish(self):
+        """
+        Completes the recording after the last iteration, replicates keep their final state in the remaining
+        iterations
+        :return:
+        """
+        self.counts[:, self.iterations + 1:] = self.counts[:, self.iterations:self.iterations + 1]
+        if self.dwellings:
+            self.dwelling_counts[:, self.iterations + 1:] = self.dwelling_counts[:, self.iterations:self.iterations + 1]
+
+    def informed_counts(self):
+        """
+        Number of nodes that were informed up to every iteration, i.e. that are not ignorant anymore
+        :return: Array of shape (R, T + 1)
+        """
+        return self.counts[:, :, :2].sum(axis=2)
+
+    def peak_spreading(self):
+        """
+        Highest number of spreading nodes of every replicate and the first iteration it was reached
+        :return: Tuple of two arrays of shape (R,), the peak and its iteration
+        """
+        spreading = self.counts[:, :, 1]
+        return spreading.max(axis=1), spreading.argmax(axis=1)
+
+    def time_to_fraction(self, fraction):
+        """
+        First iteration in which at least a fraction of all nodes was informed
+        :param fraction: Float between 0 and 1
+        :return: Array of shape (R,) with the iteration, -1 for replicates that never reached the fraction
+        """
+        number_nodes = self.counts[0, 0].sum()
+        return _first(self.informed_counts() >= fraction * number_nodes, axis=1)
+
+    def dwelling_reach_times(self):
+        """
+        First iteration in which a node of every dwelling was informed, needs dwellings or infection_times to be
+        recorded
+        :return: Array of shape (R, D) with the iteration, -1 for dwellings that were never reached. Column 0 is the
+            city, column v + 1 village v
+        """
+        if self.dwellings:
+            sizes = np.diff(self.offsets)
+            return _first(self.dwelling_counts[..., 2] < sizes, axis=1)
+        if self.infection_times:
+            times = np.where(self.infection_time < 0, np.iinfo(np.int16).max, self.infection_time)
+            reach = np.minimum.reduceat(times, self.offsets[:-1], axis=1)
+            return np.where(reach == np.iinfo(np.int16).max, -1, reach)
+        raise ValueError("Dwelling reach times need dwellings or infection_times to be recorded")
+
+    def summary(self, fractions=(0.5, 0.9)):
+        """
+        Collects the main statistics of every replicate
+        :param fractions: Floats of the fractions of informed nodes to report the time to
+        :return: Dictionary mapping the statistic name to an array of shape (R,)
+        """
+        peak, peak_time = self.peak_spreading()
+        summary = {"stop_time": self.stop_times, "peak_spreading": peak, "peak_time": peak_time,
+                   "final_informed": self.informed_counts()[:, -1]}
+        for fraction in fractions:
+            summary[f"time_to_{fraction:g}"] = self.time_to_fraction(fraction)
+        if self.dwellings or self.infection_times:
+            reach = self.dwelling_reach_times()[:, 1:]
+            summary["villages_reached"] = (reach >= 0).sum(axis=1)
+            summary["last_village_reach_time"] = np.where((reach >= 0).all(axis=1), reach.max(axis=1, initial=0), -1)
+        return summary
+
+    def save(self, path):
+        """
+        Stores the recorded arrays in a compressed .npz file
+        :param path: String containing the path of the file
+        :return:
+        """
+        arrays = {"offsets": self.offsets, "counts": self.counts, "stop_times": self.stop_times}
+        if self.dwellings:
+            arrays["dwelling_counts"] = self.dwelling_counts
+        if self.infection_times:
+            arrays["infection_time"] = self.infection_time
+        np.savez_compressed(path, **arrays)
+
+
+def _first(mask, axis):
+    """
+    Helper function to find the first True entry along an axis
+    :param mask: Boolean array
+    :param axis: Int indicating the axis to search
+    :return: Array with the index of the first True entry, -1 where there is none
+    """
+    return np.where(mask.any(axis=axis), mask.argmax(axis=axis), -1)
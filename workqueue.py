@@ -0,0 +1,337 @@
+import argparse
+import itertools
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import traceback
+
+# States of a task in the queue
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_index INTEGER PRIMARY KEY,
+    task BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    row BLOB,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, task_index);
+"""
+
+
+class WorkQueue:
+    """
+    Queue of the tasks of a sweep in a SQLite database, so a sweep can be split over any number of worker processes
+    on any number of machines that share a filesystem, without an external service. A coordinator enqueues the
+    settings and tasks of the sweep, workers claim tasks with a lease, run them and write their rows back. Tasks
+    whose lease expired, e.g. because their worker died, are claimed again by the other workers.
+    SQLite relies on the file locks of the filesystem, which need to work across machines, e.g. NFS with locking
+    enabled. A task that raises an exception is given to the workers again until it failed max_attempts times, then it
+    is marked as failed, so a broken task does not take down every worker
+    """
+
+    def __init__(self, path, timeout=60.0):
+        """
+        Constructor that opens or creates the database
+        :param path: String containing the path of the SQLite database
+        :param timeout: Float indicating the seconds to wait for a lock held by another process
+        """
+        self.path = path
+        # Transactions are started explicitly, so claiming a task is one atomic write transaction
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.executescript(SCHEMA)
+        if "error" not in [column[1] for column in self.connection.execute("PRAGMA table_info(tasks)")]:
+            # Queue created before the errors of failed tasks were recorded
+            self.connection.execute("ALTER TABLE tasks ADD COLUMN error TEXT")
+
+    def close(self):
+        """
+        Closes the database
+        :return:
+        """
+        self.connection.close()
+
+    def _transaction(self):
+        """
+        Helper function to start a write transaction, taking the write lock right away so that no other process can
+        claim the same tasks in between
+        :return: sqlite3.Connection to use as context manager, commits on success and rolls back on errors
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def get(self, key, default=None):
+        """
+        Reads a value stored with set
+        :param key: String identifying the value
+        :param default: Value returned if nothing is stored under key
+        :return: Stored value
+        """
+        stored = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if stored is None else pickle.loads(stored[0])
+
+    def enqueue(self, config, tasks, fingerprint=None, batch_size=10000):
+        """
+        Stores the settings and tasks of a sweep. Enqueueing the same sweep again only adds the missing tasks, so an
+        interrupted coordinator can be restarted
+        :param config: SimSettings object that contains the baseline parameters, run by all workers
+        :param tasks: Iterable of SweepTask objects, generated lazily
+        :param fingerprint: Optional string identifying the sweep, enqueueing a different sweep raises a ValueError
+        :param batch_size: Int indicating the number of tasks inserted per transaction
+        :return: Int indicating the number of tasks in the queue
+        """
+        stored = self.get("fingerprint")
+        if stored is not None and stored != fingerprint:
+            raise ValueError(f"The queue {self.path} belongs to a different sweep, remove it to start over")
+        settings = {name: getattr(config, name) for name in dir(config)
+                    if not name.startswith("_") and not callable(getattr(config, name))}
+        with self._transaction() as connection:
+            connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                   [("settings", pickle.dumps(settings)), ("fingerprint", pickle.dumps(fingerprint))])
+        tasks = iter(tasks)
+        while batch := list(itertools.islice(tasks, batch_size)):
+            with self._transaction() as connection:
+                connection.executemany("INSERT OR IGNORE INTO tasks (task_index, task) VALUES (?, ?)",
+                                       [(task.index, pickle.dumps(task)) for task in batch])
+        return self.connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def settings(self):
+        """
+        Creates the SimSettings of the enqueued sweep
+        :return: SimSettings object
+        """
+        from simulation import SimSettings
+
+        config = SimSettings()
+        for name, value in self.get("settings", {}).items():
+            setattr(config, name, value)
+        return config
+
+    def claim(self, worker, size=1, lease=600.0, max_attempts=3):
+        """
+        Atomically claims pending tasks and tasks whose lease expired. A task whose lease expired after max_attempts
+        claims, e.g. because it kills its worker, is marked as failed instead
+        :param worker: String identifying the worker
+        :param size: Int indicating the maximum number of tasks to claim
+        :param lease: Float indicating the seconds the worker has to finish the tasks before they are given to others
+        :param max_attempts: Int indicating the number of times a task is claimed before it is marked as failed
+        :return: List of SweepTask objects, empty if there is nothing to claim
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("UPDATE tasks SET status = ?, error = COALESCE(error, 'lease expired') "
+                               "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                               (FAILED, RUNNING, now, max_attempts))
+            claimed = connection.execute(
+                "SELECT task_index, task FROM tasks WHERE status = ? OR (status = ? AND lease_until < ?) "
+                "ORDER BY task_index LIMIT ?", (PENDING, RUNNING, now, size)).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1 "
+                "WHERE task_index = ?", [(RUNNING, worker, now + lease, index) for index, _ in claimed])
+        return [pickle.loads(task) for _, task in claimed]
+
+    def complete(self, worker, task, row, remaining=(), lease=600.0):
+        """
+        Stores the row of a finished task and renews the lease of the other tasks the worker still holds. A task that
+        was already finished by another worker after its lease expired keeps the first row
+        :param worker: String identifying the worker
+        :param task: SweepTask object that was run
+        :param row: Dictionary row as generated by get_row_dict
+        :param remaining: Iterable of SweepTask objects the worker claimed and did not finish yet
+        :param lease: Float indicating the seconds the lease of the remaining tasks is extended to
+        :return:
+        """
+        with self._transaction() as connection:
+            connection.execute("UPDATE tasks SET status = ?, worker = ?, row = ? WHERE task_index = ? AND status != ?",
+                               (DONE, worker, pickle.dumps(row), task.index, DONE))
+            self._renew(connection, worker, remaining, lease)
+
+    def fail(self, worker, task, error, remaining=(), lease=600.0, max_attempts=3):
+        """
+        Records the error of a task that raised an exception and renews the lease of the other tasks the worker still
+        holds. The task is pending again, so it is retried, until it was claimed max_attempts times, then it is
+        marked as failed
+        :param worker: String identifying the worker
+        :param task: SweepTask object that failed
+        :param error: String describing the error, e.g. the traceback
+        :param remaining: Iterable of SweepTask objects the worker claimed and did not finish yet
+        :param lease: Float indicating the seconds the lease of the remaining tasks is extended to
+        :param max_attempts: Int indicating the number of attempts after which the task is marked as failed
+        :return:
+        """
+        with self._transaction() as connection:
+            connection.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, "
+                               "lease_until = NULL WHERE task_index = ? AND worker = ? AND status = ?",
+                               (max_attempts, FAILED, PENDING, error, task.index, worker, RUNNING))
+            self._renew(connection, worker, remaining, lease)
+
+    @staticmethod
+    def _renew(connection, worker, tasks, lease):
+        """
+        Helper function to extend the lease of the tasks a worker holds, within a transaction
+        :param connection: sqlite3.Connection with an open write transaction
+        :param worker: String identifying the worker
+        :param tasks: Iterable of SweepTask objects
+        :param lease: Float indicating the seconds the lease is extended to
+        :return:
+        """
+        connection.executemany("UPDATE tasks SET lease_until = ? WHERE task_index = ? AND worker = ? AND status = ?",
+                               [(time.time() + lease, task.index, worker, RUNNING) for task in tasks])
+
+    def counts(self):
+        """
+        Counts the tasks in every state
+        :return: Dictionary mapping pending, running, done and failed to the number of tasks
+        """
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        counts.update(self.connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+        return counts
+
+    def failures(self):
+        """
+        Lists the tasks that are marked as failed
+        :return: List of (task_index, attempts, error) tuples
+        """
+        return self.connection.execute("SELECT task_index, attempts, error FROM tasks WHERE status = ? "
+                                       "ORDER BY task_index", (FAILED,)).fetchall()
+
+    def results(self, skip=(), batch_size=1000):
+        """
+        Reads the finished tasks and their rows in the order of the tasks
+        :param skip: Set of task indices that are left out, e.g. the tasks already stored in a ResultSink
+        :param batch_size: Int indicating the number of tasks read at once
+        :return: Generator of lists of (SweepTask, row) tuples
+        """
+        last = -1
+        while rows := self.connection.execute(
+                "SELECT task_index, task, row FROM tasks WHERE status = ? AND task_index > ? ORDER BY task_index "
+                "LIMIT ?", (DONE, last, batch_size)).fetchall():
+            last = rows[-1][0]
+            batch = [(pickle.loads(task), pickle.loads(row)) for index, task, row in rows if index not in skip]
+            if batch:
+                yield batch
+
+
+def worker_id():
+    """
+    Helper function to identify the current worker process
+    :return: String containing the host name and process id
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def work(queue, batch_size=10, lease=600.0, poll=10.0, worker=None, max_attempts=3):
+    """
+    Worker loop that claims and runs tasks until every task of the queue is done or failed. While other workers still
+    hold tasks, the worker waits and polls for tasks whose lease expired. A task that raises an exception is recorded
+    with its traceback and retried until it failed max_attempts times
+    :param queue: WorkQueue object
+    :param batch_size: Int indicating the number of tasks claimed at once
+    :param lease: Float indicating the seconds a worker has to finish a task, should be well above the run time of
+        batch_size tasks
+    :param poll: Float indicating the seconds to wait between polls while other workers hold the remaining tasks
+    :param worker: Optional string identifying the worker, host name and process id if None
+    :param max_attempts: Int indicating the number of attempts after which a task is marked as failed
+    :return: Int indicating the number of tasks this worker ran
+    """
+    from sweep import run_task
+
+    worker = worker_id() if worker is None else worker
+    config = queue.settings()
+    number_tasks = 0
+    while True:
+        tasks = queue.claim(worker, size=batch_size, lease=lease, max_attempts=max_attempts)
+        if not tasks:
+            if not queue.counts()[RUNNING]:
+                return number_tasks
+            time.sleep(poll)
+            continue
+        for position, task in enumerate(tasks):
+            try:
+                row = run_task(config, task)
+            except Exception as error:
+                print(f"Task {task.index} failed: {error!r}")
+                queue.fail(worker, task, traceback.format_exc(), remaining=tasks[position + 1:], lease=lease,
+                           max_attempts=max_attempts)
+                continue
+            queue.complete(worker, task, row, remaining=tasks[position + 1:], lease=lease)
+            number_tasks += 1
+
+
+def export_results(queue, sink):
+    """
+    Appends the finished tasks of a queue to a ResultSink, leaving out the tasks the sink already holds
+    :param queue: WorkQueue object
+    :param sink: ResultSink object
+    :return: Int indicating the number of tasks that were appended
+    """
+    number_tasks = 0
+    for batch in queue.results(skip=sink.completed()):
+        tasks, rows = zip(*batch)
+        sink.append(list(tasks), list(rows))
+        number_tasks += len(batch)
+    return number_tasks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Distributes the experiments over workers through a SQLite work queue on a shared filesystem",
+        epilog="enqueue takes the arguments of main.py for the settings of the sweep, e.g. "
+               "python workqueue.py enqueue queue.db --runs 10 --vary spreading_prob 0.2 0.4")
+    parser.add_argument("command", choices=("enqueue", "work", "status", "export"),
+                        help="enqueue the experiments, run a worker, show the progress or export the results to "
+                             "csv/{seed}")
+    parser.add_argument("path", help="path of the SQLite database")
+    parser.add_argument("--batch-size", type=int, default=10, help="number of tasks a worker claims at once")
+    parser.add_argument("--lease", type=float, default=600.0,
+                        help="seconds a worker has to finish its tasks before they are given to other workers")
+    parser.add_argument("--poll", type=float, default=10.0,
+                        help="seconds a worker waits between polls for tasks of workers that died")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="number of attempts after which a task that raises an error or kills its worker is "
+                             "marked as failed")
+    args, settings = parser.parse_known_args()
+    if settings and args.command != "enqueue":
+        parser.error(f"unrecognized arguments: {' '.join(settings)}")
+
+    queue = WorkQueue(args.path)
+    if args.command == "enqueue":
+        from design import SweepSpec
+        from results import sweep_fingerprint
+        from simulation import parse_settings
+
+        cfg, exp = parse_settings(settings)
+        if cfg.adaptive:
+            parser.error("the adaptive mode cannot be run from a work queue")
+        spec = SweepSpec.load(cfg.sweep_spec, cfg, exp) if cfg.sweep_spec is not None else \
+            SweepSpec.from_experiments(cfg, exp)
+        print(f"{queue.enqueue(cfg, spec.tasks(), fingerprint=sweep_fingerprint(cfg, spec.tasks()))} tasks enqueued")
+    elif args.command == "work":
+        number_tasks = work(queue, batch_size=args.batch_size, lease=args.lease, poll=args.poll,
+                            max_attempts=args.max_attempts)
+        print(f"{number_tasks} tasks run")
+    elif args.command == "status":
+        print(", ".join(f"{count} {status}" for status, count in queue.counts().items()))
+        for index, attempts, error in queue.failures():
+            print(f"task {index} failed after {attempts} attempts: {error.strip().splitlines()[-1]}")
+    else:
+        from results import ResultSink
+
+        cfg = queue.settings()
+        sink = ResultSink(f"csv/{cfg.seed}/store", fingerprint=queue.get("fingerprint"))
+        print(f"{export_results(queue, sink)} tasks exported")
+        number_failed = queue.counts()[FAILED]
+        if number_failed:
+            print(f"{number_failed} tasks failed and are missing from the results, see status")
+        sink.export_csv(f"csv/{cfg.seed}")
+    queue.close()